@@ -0,0 +1,420 @@
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from dispatch import Dispatcher
+from food_store import autocomplete_stores, load_food_stores, rank_stores, recommend_stores, search_stores
+from query_cache import QueryCache
+from rider import RiderRegistry
+from sharding import ShardedRiders, ShardPool
+from routing import Router, load_road_graph
+from utils import PRICE_RANGE
+from workload import generate_catalogue, generate_requests, generate_riders, generate_road_graph, kiosk_requests, read_requests, write_requests
+
+# Replays a request log (see workload.py for the format) through the same code paths the apps
+# use and reports latency percentiles, throughput and memory, e.g.
+#   python bench.py --stores 20000 --riders 5000 --requests 5000
+#   python bench.py --save-baseline baseline.json          # record today's numbers
+#   python bench.py --baseline baseline.json               # exit 1 if a p99 regressed
+#   python bench.py --workers 4                            # exit 1 if shards answer differently
+# Every run also starts the front ends themselves in fresh processes and exits 1 when they miss
+# STARTUP_TARGETS_MS.
+
+# Cold-process targets, interpreter start included: "interactive" is when a front end shows its
+# first screen, "ready" when it has answered its first search (catalogue, riders and road graph
+# loaded, see core.Services). The Flet stages only run where flet is installed.
+STARTUP_TARGETS_MS = {"startup_cli_interactive": 100, "startup_cli_ready": 1000,
+                      "startup_flet_interactive": 1000, "startup_flet_ready": 1500}
+
+# Answers to the CLI's prompts up to its first list of stores
+CLI_ANSWERS = "200\n12:00\n5\nfastfood\n\n"
+
+# Runs main.py with ft.app swapped for a stand-in page: main() builds the first screen into it,
+# then the probe waits for the app's services as its Submit button does
+FLET_PROBE = """
+import os, runpy, sys
+import flet as ft
+
+class Window:
+    def center(self):
+        pass
+
+class Page:
+    def __init__(self):
+        self.window = Window()
+
+    def add(self, *controls):
+        print("shown", flush=True)
+
+    def launch_url(self, url):
+        pass
+
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+ft.app = lambda target, **kwargs: target(Page())
+app = runpy.run_path(sys.argv[1], run_name="__main__")
+app["services"].wait()
+print("ready", flush=True)
+os._exit(0)
+"""
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(latencies, elapsed=None):
+    latencies = sorted(latencies)
+    total = elapsed if elapsed is not None else sum(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "max_ms": round(latencies[-1] * 1000, 4) if latencies else 0.0,
+        "per_second": round(len(latencies) / total, 1) if total else 0.0,
+    }
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def prepare(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    paths = {name: os.path.join(args.workdir, name) for name in ("eateries.csv", "riders.json", "eateries.snapshot", "roads.json")}
+    if args.regenerate or not os.path.exists(paths["eateries.csv"]):
+        generate_catalogue(paths["eateries.csv"], args.stores)
+    if args.regenerate or not os.path.exists(paths["riders.json"]):
+        generate_riders(paths["riders.json"], args.riders)
+    if args.regenerate or not os.path.exists(paths["roads.json"]):
+        generate_road_graph(paths["roads.json"])
+    if args.log is None:
+        args.log = os.path.join(args.workdir, "requests.jsonl")
+        if args.regenerate or not os.path.exists(args.log):
+            write_requests(args.log, generate_requests(args.requests))
+    return paths
+
+
+def time_markers(command, cwd, answers, markers):
+    # Seconds from starting command until its stdout first shows each marker, in order; a marker
+    # is a tuple of alternatives. The process is killed once the last one is seen.
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        process.stdin.write(answers.encode())
+        process.stdin.close()
+        output, seen = "", []
+        while len(seen) < len(markers):
+            chunk = os.read(process.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError(f"{command[-1]} exited before {markers[len(seen)][0]!r}: {process.stderr.read().decode()}")
+            output += chunk.decode(errors="replace")
+            while len(seen) < len(markers) and any(marker in output for marker in markers[len(seen)]):
+                seen.append(time.perf_counter() - start)
+        return seen
+    finally:
+        process.kill()
+        process.wait()
+
+
+def measure_startup(paths, runs):
+    # Both front ends run from the bench directory, so their default paths pick up its data
+    here = os.path.dirname(os.path.abspath(__file__))
+    cwd = os.path.dirname(os.path.abspath(paths["eateries.csv"]))
+    probes = {"cli": ([sys.executable, "-u", os.path.join(here, "main(noflet).py")], CLI_ANSWERS,
+                      [("Enter your budget",), ("Here are your recommended food stores", "No food stores match")])}
+    if importlib.util.find_spec("flet") is not None:
+        probes["flet"] = ([sys.executable, "-c", FLET_PROBE, os.path.join(here, "main.py")], "", [("shown",), ("ready",)])
+    results = {}
+    for name, (command, answers, markers) in probes.items():
+        interactive, ready = zip(*(time_markers(command, cwd, answers, markers) for _ in range(runs)))
+        results[f"startup_{name}_interactive"] = summarize(interactive)
+        results[f"startup_{name}_ready"] = summarize(ready)
+    return results
+
+
+def check_shards(paths, requests, workers, ranks=500, nearest=300):
+    # Replays the first `ranks` requests (first page and the page after it) and `nearest` rider
+    # searches through a ShardPool and through the single-process code, then reloads an edited
+    # copy of the CSV and replays the ranks again. Returns how many answers differed.
+    workdir = os.path.join(os.path.dirname(paths["eateries.csv"]), "shard_check")
+    os.makedirs(workdir, exist_ok=True)
+    csv_path, snapshot_path = os.path.join(workdir, "eateries.csv"), os.path.join(workdir, "eateries.snapshot")
+    with open(paths["eateries.csv"], 'r', encoding='utf-8', newline='') as f:
+        records = list(csv.DictReader(f))
+
+    def write_csv(records):
+        with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0]))
+            writer.writeheader()
+            writer.writerows(records)
+
+    def rank_mismatches(pool):
+        mismatches = 0
+        for request in requests[:ranks]:
+            query = (request["budget"], request["time"], request["proximity"], request["cuisine"], (request["lat"], request["lon"]))
+            expected = rank_stores(pool.food_stores.current, *query)
+            mismatches += pool.rank(*query) != expected
+            if expected[1]:
+                mismatches += pool.rank(*query, cursor=expected[1]) != rank_stores(pool.food_stores.current, *query, cursor=expected[1])
+        return mismatches
+
+    write_csv(records)
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    pool = ShardPool(workers, csv_path, snapshot_path, roads_path="")
+    try:
+        mismatches = rank_mismatches(pool)
+
+        fleet = RiderRegistry(path=paths["riders.json"], feed_path=None)
+        fleet.load()
+        single = RiderRegistry(path=None, feed_path=None)
+        sharded = ShardedRiders(pool, path=None, feed_path=None)
+        for rider in fleet.riders.values():
+            if rider["location"]:
+                for registry in (single, sharded):
+                    registry.update(rider["id"], rider["location"], rider["availability"])
+        for request in requests[:nearest]:
+            location = (request["lat"], request["lon"])
+            mismatches += ([(distance, rider["id"]) for distance, rider in sharded.nearest_available(location, 6)]
+                           != [(distance, rider["id"]) for distance, rider in single.nearest_available(location, 6)])
+
+        # A reload that drops every 10th store and reprices every 7th, picked up by the parent only
+        for i, record in enumerate(records):
+            if i % 7 == 0:
+                record.update(min_price=int(record["min_price"]) + 5, max_price=int(record["max_price"]) + 5)
+        write_csv([record for i, record in enumerate(records) if i % 10])
+        pool.food_stores.reload()
+        mismatches += rank_mismatches(pool)
+    finally:
+        pool.stop()
+    return mismatches
+
+
+def run(args):
+    paths = prepare(args)
+    requests = read_requests(args.log)
+    results = {}
+
+    # Cold start parses the CSV and writes the snapshot; warm start maps the snapshot
+    if os.path.exists(paths["eateries.snapshot"]):
+        os.remove(paths["eateries.snapshot"])
+    tracemalloc.start()
+    cold, _ = timed(load_food_stores, paths["eateries.csv"], paths["eateries.snapshot"])
+    results["catalogue_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    tracemalloc.stop()
+    warm, catalogue = timed(load_food_stores, paths["eateries.csv"], paths["eateries.snapshot"])
+    results["load_cold"] = summarize([cold])
+    results["load_warm"] = summarize([warm])
+    # After load_cold, so the snapshot is there as it would be on a kiosk restart
+    results.update(measure_startup(paths, args.startup_runs))
+
+    latencies, chosen = [], []
+    start = time.perf_counter()
+    for request in requests:
+        elapsed, stores = timed(recommend_stores, catalogue, request["budget"], request["time"],
+                                request["proximity"], request["cuisine"], (request["lat"], request["lon"]))
+        latencies.append(elapsed)
+        if request["need_rider"] and stores:
+            chosen.append((stores[0]["lat"], stores[0]["lon"]))
+    results["recommend"] = summarize(latencies, time.perf_counter() - start)
+
+    # Same requests under the stricter "budget within the price range" semantics
+    latencies = [timed(recommend_stores, catalogue, request["budget"], request["time"], request["proximity"],
+                       request["cuisine"], (request["lat"], request["lon"]), None, PRICE_RANGE)[0] for request in requests]
+    results["recommend_range"] = summarize(latencies)
+
+    latencies = [timed(rank_stores, catalogue, request["budget"], request["time"], request["proximity"],
+                       request["cuisine"], (request["lat"], request["lon"]))[0] for request in requests]
+    results["rank_top10"] = summarize(latencies)
+
+    # Throughput with the ranking spread over shard processes, fed by as many concurrent clients
+    # as there are workers; compare per_second with rank_top10
+    if args.workers > 1:
+        pool = ShardPool(args.workers, paths["eateries.csv"], paths["eateries.snapshot"], roads_path="")
+        try:
+            def rank_sharded(request):
+                return timed(pool.rank, request["budget"], request["time"], request["proximity"], request["cuisine"],
+                             (request["lat"], request["lon"]))[0]
+            with ThreadPoolExecutor(2 * args.workers) as clients:
+                start = time.perf_counter()
+                latencies = list(clients.map(rank_sharded, requests))
+                results["rank_sharded"] = summarize(latencies, time.perf_counter() - start)
+        finally:
+            pool.stop()
+        results["shard_mismatches"] = check_shards(paths, requests, args.workers)
+
+    # The same log through the shared query cache; the hit rate depends on how clustered it is
+    cache = QueryCache()
+    latencies = [timed(recommend_stores, catalogue, request["budget"], request["time"], request["proximity"],
+                       request["cuisine"], (request["lat"], request["lon"]), cache)[0] for request in requests]
+    results["recommend_cached"] = summarize(latencies)
+    results["cache_hit_rate"] = round(cache.stats()["hit_rate"], 3)
+
+    # The same log sent from a few fixed kiosks, with and without the cache
+    kiosk_log = kiosk_requests(requests)
+    latencies = [timed(recommend_stores, catalogue, request["budget"], request["time"], request["proximity"],
+                       request["cuisine"], (request["lat"], request["lon"]))[0] for request in kiosk_log]
+    results["recommend_kiosk"] = summarize(latencies)
+    cache = QueryCache()
+    latencies = [timed(recommend_stores, catalogue, request["budget"], request["time"], request["proximity"],
+                       request["cuisine"], (request["lat"], request["lon"]), cache)[0] for request in kiosk_log]
+    results["recommend_kiosk_cached"] = summarize(latencies)
+    results["kiosk_cache_hit_rate"] = round(cache.stats()["hit_rate"], 3)
+
+    # Search-as-you-type over store names: every prefix of a sample of names, then a typo'd name
+    elapsed, _ = timed(catalogue.name_index)
+    results["search_index_build"] = summarize([elapsed])
+    names = [catalogue.names[row] for row in range(0, len(catalogue), max(1, len(catalogue) // 200))]
+    latencies = [timed(autocomplete_stores, catalogue, name[:length], 10)[0]
+                 for name in names for length in range(1, len(name) + 1)]
+    results["autocomplete"] = summarize(latencies)
+    latencies = [timed(search_stores, catalogue, name[:-1] + "x", 10)[0] for name in names]
+    results["search_fuzzy"] = summarize(latencies)
+
+    riders = RiderRegistry(path=paths["riders.json"])
+    elapsed, _ = timed(riders.load)
+    results["riders_load"] = summarize([elapsed])
+
+    latencies = [timed(riders.nearest_available, location, 6)[0] for location in chosen]
+    results["rider_nearest"] = summarize(latencies)
+
+    # Position pings against a fleet with heartbeat expiry, then one sweep after everyone timed out
+    live = RiderRegistry(path=None, feed_path=None, ttl=60.0)
+    fleet = list(riders.riders.values())
+    latencies = [timed(live.update, rider["id"], rider["location"], rider["availability"])[0]
+                 for _ in range(3) for rider in fleet if rider["location"]]
+    results["rider_heartbeat"] = summarize(latencies)
+    elapsed, _ = timed(live.expire, time.monotonic() + live.ttl)
+    results["rider_expire_all"] = summarize([elapsed])
+
+    # Batches as the dispatcher would see them; assigned riders are freed again between batches
+    # Share of orders left without a rider is reported too, since a fast solver that drops orders
+    # would look like a win on latency alone
+    dispatcher = Dispatcher(riders)
+    latencies, unassigned = [], 0
+    for i in range(0, len(chosen), args.batch):
+        elapsed, assignments = timed(dispatcher.assign, chosen[i:i + args.batch])
+        latencies.append(elapsed)
+        unassigned += assignments.count(None)
+        for assignment in filter(None, assignments):
+            riders.update(assignment[1]["id"], availability=True)
+    results["dispatch_batch"] = summarize(latencies)
+    results["dispatch_unassigned"] = round(unassigned / len(chosen), 3) if chosen else 0.0
+
+    # Lunch rush: whole batches of orders from within ~200 m of one store, which compete for the
+    # same nearest riders
+    rng = random.Random(7)
+    latencies, unassigned, orders = [], 0, 0
+    for lat, lon in chosen[::max(1, len(chosen) // 10)]:
+        rush = [(lat + rng.uniform(-0.002, 0.002), lon + rng.uniform(-0.002, 0.002)) for _ in range(args.batch)]
+        elapsed, assignments = timed(dispatcher.assign, rush)
+        latencies.append(elapsed)
+        unassigned += assignments.count(None)
+        orders += len(rush)
+        for assignment in filter(None, assignments):
+            riders.update(assignment[1]["id"], availability=True)
+    results["dispatch_rush"] = summarize(latencies)
+    results["dispatch_rush_unassigned"] = round(unassigned / orders, 3) if orders else 0.0
+
+    # The same batches matched on road travel time; the first sight of each store builds its table
+    elapsed, graph = timed(load_road_graph, paths["roads.json"])
+    results["roads_load"] = summarize([elapsed])
+    router = Router(graph)
+    dispatcher = Dispatcher(riders, router=router)
+    latencies, unassigned = [], 0
+    for i in range(0, len(chosen), args.batch):
+        elapsed, assignments = timed(dispatcher.assign, chosen[i:i + args.batch])
+        latencies.append(elapsed)
+        unassigned += assignments.count(None)
+        for assignment in filter(None, assignments):
+            riders.update(assignment[1]["id"], availability=True)
+    results["dispatch_batch_eta"] = summarize(latencies)
+    results["dispatch_eta_unassigned"] = round(unassigned / len(chosen), 3) if chosen else 0.0
+    latencies = [timed(router.eta, rider["location"], location)[0]
+                 for location in chosen for _, rider in riders.nearest_available(location, 6)]
+    results["eta_lookup"] = summarize(latencies)
+
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+        results["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    except ImportError:
+        pass
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    failed = []
+    for stage, numbers in baseline.items():
+        if isinstance(numbers, dict) and stage in results:
+            allowed = numbers["p99_ms"] * (1 + tolerance)
+            if results[stage]["p99_ms"] > allowed:
+                failed.append(f"{stage}: p99 {results[stage]['p99_ms']} ms > {allowed:.4f} ms allowed")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a request log through Ride&Dine and report latency")
+    parser.add_argument("--log", help="Request log (JSON lines); generated into --workdir when omitted")
+    parser.add_argument("--workdir", default="bench_data")
+    parser.add_argument("--stores", type=int, default=20000)
+    parser.add_argument("--riders", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=50, help="Orders per dispatch batch")
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild the synthetic data")
+    parser.add_argument("--baseline", help="Fail when a stage's p99 is worse than this saved report")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p99 slowdown against --baseline")
+    parser.add_argument("--save-baseline", help="Write this run's report here")
+    parser.add_argument("--startup-runs", type=int, default=5, help="Fresh processes started to time startup")
+    parser.add_argument("--workers", type=int, default=0, help="Also rank through this many shard processes")
+    parser.add_argument("--metrics", help="Record the built-in metrics during the run and write them here")
+    parser.add_argument("--profile", help="Sample stacks during the run and write collapsed stacks here")
+    args = parser.parse_args()
+
+    metrics.enable(bool(args.metrics))
+    profiler = metrics.SamplingProfiler().start() if args.profile else None
+    results = run(args)
+    if profiler:
+        profiler.stop().write(args.profile)
+        for name, share in profiler.top(5):
+            print(f"profile {share:6.1%} {name}")
+    if args.metrics:
+        metrics.write(args.metrics)
+    for stage, numbers in results.items():
+        if isinstance(numbers, dict):
+            print(f"{stage:16} n={numbers['count']:<6} p50={numbers['p50_ms']:>9.3f} ms  p99={numbers['p99_ms']:>9.3f} ms"
+                  f"  max={numbers['max_ms']:>9.3f} ms  {numbers['per_second']:>10.1f}/s")
+        else:
+            print(f"{stage:16} {numbers}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+    failed = [f"{stage}: p99 {results[stage]['p99_ms']} ms > {target} ms target"
+              for stage, target in STARTUP_TARGETS_MS.items() if stage in results and results[stage]["p99_ms"] > target]
+    if results.get("shard_mismatches"):
+        failed.append(f"shard_mismatches: {results['shard_mismatches']} sharded answers differ from single-process ones")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            failed += regressions(results, json.load(f), args.tolerance)
+    for failure in failed:
+        print(f"REGRESSION {failure}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
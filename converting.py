@@ -1,9 +1,11 @@
 import csv
 import json
+from food_store import compile_food_stores
 
 # Read CSV and convert to JSON
 csv_file = 'eateries.csv'
 json_file = 'eateries.json'
+snapshot_file = 'eateries.snapshot'
 
 data = []
 with open(csv_file, encoding='utf-8') as f:
@@ -13,3 +15,8 @@ with open(csv_file, encoding='utf-8') as f:
 
 with open(json_file, 'w', encoding='utf-8') as f:
     json.dump(data, f, indent=4)
+
+# Compile the binary catalogue snapshot the apps load at startup (load_food_stores also
+# rebuilds it on its own whenever eateries.csv changes)
+catalogue = compile_food_stores(csv_file, snapshot_file)
+print(f"Compiled {len(catalogue)} stores into {snapshot_file}")
@@ -0,0 +1,59 @@
+import threading
+import time
+import metrics
+
+# Startup shared by both front ends (main.py and main(noflet).py). Importing this module is
+# cheap: nothing is read and the data modules are only imported by the loader thread, so a front
+# end can show its first screen straight away and only a request made before loading finished
+# waits for it (see wait()).
+class Services:
+    def __init__(self, csv_path='eateries.csv', snapshot_path='eateries.snapshot', riders_path='riders.json',
+                 roads_path='roads.json'):
+        self.csv_path = csv_path
+        self.snapshot_path = snapshot_path
+        self.riders_path = riders_path
+        self.roads_path = roads_path
+        self.food_stores = None  # LiveCatalogue; it reloads itself when the CSV changes
+        self.riders = None  # RiderRegistry fed by rider_updates.jsonl and saved periodically
+        self.router = None  # Router over roads_path, or None to rank by straight-line distance
+        self.dispatcher = None  # Batches rider requests, so two orders never share a rider
+        self.error = None
+        self.load_seconds = None
+        self.loaded = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load, name="startup-loader", daemon=True)
+            self._thread.start()
+        return self
+
+    @metrics.timed("startup.load")
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            from dispatch import Dispatcher
+            from rider import load_fleet, RiderRegistry
+            from routing import load_router
+            from watcher import LiveCatalogue
+
+            self.food_stores = LiveCatalogue(self.csv_path, self.snapshot_path).start()
+            self.riders = load_fleet(RiderRegistry(path=self.riders_path)).start()
+            self.router = load_router(self.roads_path)
+            self.dispatcher = Dispatcher(self.riders, router=self.router).start()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            self.loaded.set()
+
+    def ready(self):
+        return self.loaded.is_set() and self.error is None
+
+    def wait(self, timeout=None):
+        # Blocks until loading is done and returns self; re-raises what made loading fail
+        if not self.start().loaded.wait(timeout):
+            raise TimeoutError("Stores are still loading")
+        if self.error is not None:
+            raise self.error
+        return self
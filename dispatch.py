@@ -0,0 +1,197 @@
+import threading
+import metrics
+import time
+from concurrent.futures import Future
+from utils import distance_matrix, parse_location
+
+
+def hungarian(cost):
+    # Minimum-cost assignment for a rows x cols matrix with rows <= cols (Kuhn-Munkres with
+    # potentials, O(rows^2 * cols)). Returns the chosen column for every row.
+    rows, cols = len(cost), len(cost[0])
+    infinity = float("inf")
+    u = [0.0] * (rows + 1)
+    v = [0.0] * (cols + 1)
+    owner = [0] * (cols + 1)  # Row (1-based) currently holding each column, 0 for none
+    way = [0] * (cols + 1)
+
+    for i in range(1, rows + 1):
+        owner[0] = i
+        j0 = 0
+        min_slack = [infinity] * (cols + 1)
+        used = [False] * (cols + 1)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            row, u_i0 = cost[i0 - 1], u[i0]
+            delta, j1 = infinity, 0
+            for j in range(1, cols + 1):
+                if not used[j]:
+                    slack = row[j - 1] - u_i0 - v[j]
+                    if slack < min_slack[j]:
+                        min_slack[j] = slack
+                        way[j] = j0
+                    if min_slack[j] < delta:
+                        delta, j1 = min_slack[j], j
+            for j in range(cols + 1):
+                if used[j]:
+                    u[owner[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        # Flip the augmenting path back to the root
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+
+    assignment = [-1] * rows
+    for j in range(1, cols + 1):
+        if owner[j]:
+            assignment[owner[j] - 1] = j - 1
+    return assignment
+
+
+def greedy(cost):
+    # Closest free pair first; used for batches too large for the exact solver
+    pairs = sorted((distance, i, j) for i, row in enumerate(cost) for j, distance in enumerate(row))
+    assignment = [-1] * len(cost)
+    taken = set()
+    for distance, i, j in pairs:
+        if assignment[i] == -1 and j not in taken:
+            assignment[i] = j
+            taken.add(j)
+    return assignment
+
+
+def solve(cost, exact_limit):
+    # Each row gets at most one column and each column at most one row; -1 means no column left
+    if not cost or not cost[0]:
+        return [-1] * len(cost)
+    if len(cost) * len(cost[0]) > exact_limit:
+        return greedy(cost)
+    if len(cost) <= len(cost[0]):
+        return hungarian(cost)
+    # More orders than riders: match every rider to an order instead
+    transposed = hungarian([list(column) for column in zip(*cost)])
+    assignment = [-1] * len(cost)
+    for j, i in enumerate(transposed):
+        assignment[i] = j
+    return assignment
+
+
+# Collects "need a rider" requests for a short window and assigns the whole batch at once, so
+# simultaneous orders can't be handed the same rider and total rider travel is minimised. With a
+# Router (see routing.py) riders are matched on road travel time instead of straight-line distance.
+class Dispatcher:
+    def __init__(self, registry, window=0.3, candidates=6, exact_limit=40_000, router=None):
+        self.registry = registry
+        self.router = router
+        self.window = window  # Seconds to wait for more orders after the first one arrives
+        self.candidates = candidates  # Nearest riders considered per order
+        self.exact_limit = exact_limit  # Largest orders x riders matrix solved exactly
+        self.pending = []  # (store location, Future)
+        self.condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="dispatcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def request(self, location):
+        # Returns a Future resolving to (distance_km, rider), or None if no rider is free.
+        # A location that isn't a (lat, lon) pair of finite numbers, e.g. a store without a map
+        # pin, raises ValueError here rather than failing the batch it would have joined.
+        location = parse_location(location)
+        future = Future()
+        with self.condition:
+            self.pending.append((location, future))
+            self.condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            time.sleep(self.window)
+            with self.condition:
+                batch, self.pending = self.pending, []
+            # Orders whose caller gave up (e.g. a cancelled asyncio task) get no rider; the rest can
+            # no longer be cancelled, so delivering their result below can't fail
+            batch = [(location, future) for location, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            metrics.count("dispatch.batches")
+            metrics.count("dispatch.orders", len(batch))
+            try:
+                results = self.assign([location for location, _ in batch])
+            except Exception:
+                # Don't let one bad order fail the others: retry them one at a time
+                results = [self._assign_one(location) for location, _ in batch]
+            for (_, future), result in zip(batch, results):
+                try:
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                except Exception as e:
+                    print(f"Dispatch result not delivered: {e!r}")
+
+    def _assign_one(self, location):
+        try:
+            return self.assign([location])[0]
+        except Exception as e:
+            return e
+
+    @metrics.timed("dispatch.assign")
+    def assign(self, locations):
+        # Assigns riders to a batch of store locations and marks them unavailable. Everything
+        # happens under the registry lock, so no update or other batch can claim the same rider.
+        # Orders left over because their nearest candidates went to neighbours (a lunch rush
+        # around one mall) go again against the riders still free, with a wider search each
+        # round, until every order has a rider or no free rider is left.
+        registry = self.registry
+        results = [None] * len(locations)
+        pending = list(range(len(locations)))
+        k = self.candidates
+        with registry.lock:
+            while pending:
+                rider_ids = {}
+                for i in pending:
+                    for _, rider in registry.nearest_available(locations[i], k):
+                        rider_ids.setdefault(rider["id"], rider)
+                riders = list(rider_ids.values())
+                if not riders:
+                    break
+
+                batch = [locations[i] for i in pending]
+                distances = distance_matrix(batch, [rider["location"][0] for rider in riders],
+                                            [rider["location"][1] for rider in riders])
+                if self.router is not None:
+                    origins = [rider["location"] for rider in riders]
+                    cost = [self.router.etas_to(origins, location) for location in batch]
+                else:
+                    cost = distances
+                with metrics.span("dispatch.solve"):
+                    assignment = solve(cost, self.exact_limit)
+
+                unassigned = []
+                for row, (i, j) in enumerate(zip(pending, assignment)):
+                    if j == -1:
+                        unassigned.append(i)
+                        continue
+                    rider = registry.update(riders[j]["id"], availability=False, heartbeat=False)
+                    results[i] = (distances[row][j], rider)
+                if len(unassigned) == len(pending):
+                    break  # Nothing matched, e.g. every free rider unreachable by road
+                pending = unassigned
+                k = max(2 * k, len(pending))
+        if pending:
+            metrics.count("dispatch.unassigned", len(pending))
+        return results
@@ -1,34 +1,382 @@
-import json
-from collections import defaultdict
-from utils import safe_float
-
-def load_food_stores():
-    with open('eateries.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    food_stores = []
-    stores_by_type = defaultdict(list)
-
-    for record in data:
-        store = {
-            "name": record.get("name", "Unknown"),
-            "type": record.get("cuisine_type", "Unknown Cuisine"),
-            "proximity": float(record.get("proximity", 0)) / 1000,  # Convert meters to kilometers
-            "rating": safe_float(record.get("ratings", "")),
-            "fb_page": record.get("fb_page_url", "N/A"),
-            "location_url": record.get("location_url", "N/A"),
-            "time_availability": record.get("time", "N/A"),
-            "min_price": int(record.get("min_price", 0)),
-            "max_price": int(record.get("max_price", 0))
+import copy
+import csv
+import heapq
+import metrics
+from array import array
+from bisect import bisect_right, insort
+from itertools import compress, repeat
+from operator import ge, lt, mod, sub
+from search import build_cuisine_index, build_name_index
+from snapshot import file_digest, read_snapshot, write_snapshot
+from spatial import cell_of, cells_within
+from utils import safe_float, parse_coordinates, parse_opening_hours, parse_minutes, to_unit_vector, distances_from_vectors, DEFAULT_LOCATION, DEFAULT_PRICE_MODE, MINUTES_PER_DAY, PRICE_RANGE
+
+# Column-oriented store catalogue: one typed array per numeric field and a row id per store.
+# Queries work on arrays of row ids with C-level map/compress masks, and a store only becomes a
+# dict (see row()) when it is actually shown to the user.
+class Catalogue:
+    CELL_KM = 0.5
+    NUMERIC_COLUMNS = {
+        "cuisine": "H",  # Cuisine code, an index into cuisines
+        "rating": "d",
+        "min_price": "i",
+        "max_price": "i",
+        "open_from": "h",
+        "open_minutes": "h",
+        "lat": "d",
+        "lon": "d",
+        # Unit vectors for the batched distance maths, one column per axis
+        "x": "d",
+        "y": "d",
+        "z": "d",
+    }
+    STRING_COLUMNS = ("names", "fb_pages", "location_urls", "time_labels")
+
+    # Columns default to empty growable arrays; a snapshot passes in read-only views instead
+    def __init__(self, columns=None, version=None, snapshot=None):
+        columns = columns or {}
+        for name, typecode in self.NUMERIC_COLUMNS.items():
+            setattr(self, name, columns.get(name, array(typecode)))
+        for name in self.STRING_COLUMNS + ("cuisines",):
+            setattr(self, name, columns.get(name, []))
+        self.cuisine_codes = {label.lower(): code for code, label in enumerate(self.cuisines)}  # Lowercase label -> code
+        # Cuisine code -> {(row, col): row ids}; each bucket is kept sorted by min_price, so it is
+        # also the price index for its cell (see within())
+        self.cells = {code: {} for code in range(len(self.cuisines))}
+        if "cell_keys" in columns:
+            keys, starts, rows = columns["cell_keys"], columns["cell_starts"], columns["cell_rows"]
+            for i in range(len(starts) - 1):
+                code, row, col = keys[3 * i:3 * i + 3]
+                self.cells[code][(row, col)] = rows[starts[i]:starts[i + 1]]
+        self.owned_cells = set()  # (code, cell) buckets this catalogue may modify in place
+        # Rows removed by a reload; they stay in the columns but leave every index
+        self.deleted = set(columns.get("deleted", ()))
+        self.version = version
+        self.snapshot = snapshot  # Keeps the mmap behind the column views alive
+        self._name_index = None  # Search indexes, built on first use for this version
+        self._cuisine_index = None
+
+    def __len__(self):
+        return len(self.cuisine)
+
+    def cuisine_code(self, label):
+        key = label.lower()
+        code = self.cuisine_codes.get(key)
+        if code is None:
+            code = self.cuisine_codes[key] = len(self.cuisines)
+            self.cuisines.append(label)
+            self.cells[code] = {}
+        return code
+
+    def find_cuisine(self, text):
+        # Cuisine code for free text: exact label, then the same words spelled differently
+        # ("Steak / Barbecue"), then the closest label by trigram similarity; None if nothing is close
+        code = self.cuisine_codes.get(text.strip().lower())
+        if code is None:
+            if self._cuisine_index is None:
+                self._cuisine_index = build_cuisine_index(self)
+            code = self._cuisine_index.best(text)
+        return code
+
+    def restricted(self, keep):
+        # A view sharing every column but holding only the grid cells keep((row, col)) accepts,
+        # e.g. one shard's regions. It owns no cells, so it never writes into shared buckets.
+        view = copy.copy(self)
+        view.cells = {code: {cell: rows for cell, rows in cells.items() if keep(cell)} for code, cells in self.cells.items()}
+        view.owned_cells = set()
+        view._name_index = None
+        return view
+
+    def name_index(self):
+        if self._name_index is None:
+            self._name_index = build_name_index(self)
+        return self._name_index
+
+    def add(self, record):
+        row = len(self)
+        for name in self.NUMERIC_COLUMNS:
+            getattr(self, name).append(0)
+        for name in self.STRING_COLUMNS:
+            getattr(self, name).append("")
+        self.write(row, store_fields(record))
+        return row
+
+    def write(self, row, fields):
+        code = self.cuisine_code(fields["type"])
+        coordinates = parse_coordinates(fields["location_url"])
+        # Stores without listed hours count as always open rather than being hidden
+        open_from, open_minutes = parse_opening_hours(fields["time_availability"]) or (0, MINUTES_PER_DAY)
+        lat, lon = coordinates or (float("nan"), float("nan"))
+
+        self.names[row] = fields["name"]
+        self.fb_pages[row] = fields["fb_page"]
+        self.location_urls[row] = fields["location_url"]
+        self.time_labels[row] = fields["time_availability"]
+        self.cuisine[row] = code
+        self.rating[row] = fields["rating"]
+        self.min_price[row] = fields["min_price"]
+        self.max_price[row] = fields["max_price"]
+        self.open_from[row] = open_from
+        self.open_minutes[row] = open_minutes
+        self.lat[row], self.lon[row] = lat, lon
+        self.x[row], self.y[row], self.z[row] = to_unit_vector(lat, lon)
+        # Stores without a map pin can't answer "within X km", so they stay out of the grid
+        if coordinates:
+            insort(self._bucket(code, cell_of(lat, lon, self.CELL_KM)), row, key=self.min_price.__getitem__)
+
+    def _bucket(self, code, cell):
+        # Buckets may be read-only snapshot views or shared with an older catalogue version,
+        # so a cell is copied the first time this catalogue modifies it
+        cells = self.cells[code]
+        if (code, cell) not in self.owned_cells:
+            cells[cell] = array('I', cells.get(cell, ()))
+            self.owned_cells.add((code, cell))
+        return cells[cell]
+
+    def _unplace(self, row):
+        if self.lat[row] != self.lat[row]:  # NaN, the store was never in the grid
+            return
+        code, cell = self.cuisine[row], cell_of(self.lat[row], self.lon[row], self.CELL_KM)
+        bucket = self._bucket(code, cell)
+        del bucket[bucket.index(row)]
+        if not bucket:
+            del self.cells[code][cell]
+            self.owned_cells.discard((code, cell))
+
+    def updated(self, added=(), changed=None, removed=()):
+        # Copy-on-write update for reloads: columns are copied wholesale (a memcpy each), but only
+        # the grid cells holding changed stores are rebuilt; the rest are shared with this version.
+        # Removed rows keep their slot so row ids stay stable, and simply leave the grid.
+        changed = changed or {}
+        columns = {}
+        for name, typecode in self.NUMERIC_COLUMNS.items():
+            columns[name] = array(typecode)
+            columns[name].frombytes(memoryview(getattr(self, name)).cast('B'))
+        for name in self.STRING_COLUMNS + ("cuisines",):
+            columns[name] = list(getattr(self, name))
+        catalogue = Catalogue(columns)
+        catalogue.cells = {code: dict(cells) for code, cells in self.cells.items()}
+        catalogue.deleted = self.deleted | set(removed)
+
+        for row in list(removed) + list(changed):
+            catalogue._unplace(row)
+        for row, record in changed.items():
+            catalogue.write(row, store_fields(record))
+        for record in added:
+            catalogue.add(record)
+        # Rows are matched on (name, location_url), so a changed row keeps its name and only
+        # added and removed rows touch the name index
+        if self._name_index is not None:
+            catalogue._name_index = self._name_index.extended(
+                ((catalogue.names[row], row) for row in range(len(self), len(catalogue))),
+                ((self.names[row], row) for row in removed))
+        return catalogue
+
+    def row(self, row):
+        return {
+            "id": row,
+            "name": self.names[row],
+            "type": self.cuisines[self.cuisine[row]],
+            # NaN marks a store without a map pin
+            "lat": self.lat[row] if self.lat[row] == self.lat[row] else None,
+            "lon": self.lon[row] if self.lon[row] == self.lon[row] else None,
+            "rating": self.rating[row],
+            "fb_page": self.fb_pages[row],
+            "location_url": self.location_urls[row],
+            "time_availability": self.time_labels[row],
+            "min_price": self.min_price[row],
+            "max_price": self.max_price[row],
         }
-        food_stores.append(store)
-        stores_by_type[store["type"].lower()].append(store)
-
-    return food_stores, stores_by_type
-
-def recommend_stores(food_stores, stores_by_type, budget, time, proximity, cuisine):
-    recommendations = []
-    if cuisine in stores_by_type:
-        for store in stores_by_type[cuisine]:
-            if store["proximity"] <= proximity and store["min_price"] <= budget: #removed <= store["max_price"], fixed logic
-                recommendations.append(store)
-    return recommendations
+
+    def columns(self):
+        # Numeric and string columns plus the grid cells flattened into arrays, for write_snapshot
+        keys, starts, rows = array('i'), array('I', [0]), array('I')
+        for code, cells in self.cells.items():
+            for (row, col), bucket in cells.items():
+                keys.extend((code, row, col))
+                rows.extend(bucket)
+                starts.append(len(rows))
+        numeric = {name: getattr(self, name) for name in self.NUMERIC_COLUMNS}
+        numeric.update(cell_keys=keys, cell_starts=starts, cell_rows=rows, deleted=array('I', sorted(self.deleted)))
+        return numeric, {name: getattr(self, name) for name in self.STRING_COLUMNS + ("cuisines",)}
+
+    def within(self, code, location, radius_km, budget=None, price_mode=DEFAULT_PRICE_MODE):
+        # Row ids of one cuisine inside the radius, with their distances in km. Given a budget,
+        # only stores within it under price_mode (see utils.PRICE_MODES) are returned: the affordable part of each
+        # sorted bucket is a bisect away, and priced-out stores never reach the distance maths.
+        rows = array('I')
+        buckets = cells_within(self.cells[code], location[0], location[1], radius_km, self.CELL_KM)
+        if budget is None:
+            for bucket in buckets:
+                rows.extend(bucket)
+        else:
+            min_price = self.min_price.__getitem__
+            for bucket in buckets:
+                rows.extend(bucket[:bisect_right(bucket, budget, key=min_price)])
+            if price_mode == PRICE_RANGE:
+                rows = array('I', compress(rows, map(ge, map(self.max_price.__getitem__, rows), repeat(budget))))
+        vectors = zip(map(self.x.__getitem__, rows), map(self.y.__getitem__, rows), map(self.z.__getitem__, rows))
+        distances = distances_from_vectors(location, vectors)
+        mask = list(map(ge, repeat(radius_km), distances))
+        return array('I', compress(rows, mask)), array('d', compress(distances, mask))
+
+    def open_at(self, rows, minute):
+        since_opening = map(mod, map(sub, repeat(minute), map(self.open_from.__getitem__, rows)), repeat(MINUTES_PER_DAY))
+        return map(lt, since_opening, map(self.open_minutes.__getitem__, rows))
+
+
+# Normalises a raw CSV record into the same field names and types that row() returns
+def store_fields(record):
+    return {
+        "name": record.get("name", "Unknown"),
+        "type": record.get("cuisine_type", "Unknown Cuisine"),
+        "rating": safe_float(record.get("ratings", "")),
+        "fb_page": record.get("fb_page_url", "N/A"),
+        "location_url": record.get("location_url", "N/A"),
+        "time_availability": record.get("time", "N/A"),
+        "min_price": int(record.get("min_price", 0)),
+        "max_price": int(record.get("max_price", 0)),
+    }
+
+def parse_food_stores(csv_path='eateries.csv'):
+    catalogue = Catalogue()
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for record in csv.DictReader(f):
+            catalogue.add(record)
+    return catalogue
+
+def compile_food_stores(csv_path='eateries.csv', snapshot_path='eateries.snapshot', digest=None):
+    digest = digest or file_digest(csv_path)
+    catalogue = parse_food_stores(csv_path)
+    catalogue.version = digest.hex()
+    write_snapshot(snapshot_path, digest, *catalogue.columns())
+    return catalogue
+
+@metrics.timed("catalogue.load")
+def load_food_stores(csv_path='eateries.csv', snapshot_path='eateries.snapshot'):
+    # The snapshot is mapped straight into memory; the CSV is only parsed again when its content hash changes
+    digest = file_digest(csv_path)
+    catalogue = map_food_stores(snapshot_path, digest.hex())
+    if catalogue is not None:
+        return catalogue
+    try:
+        return compile_food_stores(csv_path, snapshot_path, digest)
+    except OSError:
+        # A read-only install can still run, it just parses the CSV on every start
+        catalogue = parse_food_stores(csv_path)
+        catalogue.version = digest.hex()
+        return catalogue
+
+def map_food_stores(snapshot_path, version):
+    # The catalogue saved to snapshot_path for this version, or None when the file holds another.
+    # Shard workers use this to map the version their parent's LiveCatalogue saved.
+    snapshot = read_snapshot(snapshot_path, bytes.fromhex(version))
+    if snapshot is None:
+        return None
+    columns, mapped = snapshot
+    return Catalogue(columns, version=version, snapshot=mapped)
+
+@metrics.timed("recommend.match")
+def match_stores(catalogue, budget, time, proximity, cuisine, location=DEFAULT_LOCATION, price_mode=DEFAULT_PRICE_MODE):
+    # (distance_km, row) for every store passing the cuisine, radius, budget and opening-hours filters
+    code = catalogue.find_cuisine(cuisine)
+    if code is None:
+        return []
+
+    # Only affordable stores in grid cells around the user are measured, not the whole cuisine bucket
+    rows, distances = catalogue.within(code, location, proximity, budget, price_mode)
+    minute = parse_minutes(time) if time else None
+    if minute is None:
+        return list(zip(distances, rows))
+    return list(compress(zip(distances, rows), catalogue.open_at(rows, minute)))
+
+@metrics.timed("recommend")
+def recommend_stores(catalogue, budget, time, proximity, cuisine, location=DEFAULT_LOCATION, cache=None, price_mode=DEFAULT_PRICE_MODE):
+    # Proximity is relative to the user, so it is added to the row view rather than stored.
+    # An optional QueryCache (see query_cache.py) shares the filter work between similar queries.
+    match = cache.match if cache is not None else match_stores
+    return [dict(catalogue.row(row), proximity=round(distance, 2))
+            for distance, row in sorted(match(catalogue, budget, time, proximity, cuisine, location, price_mode))]
+
+
+# Each part of the score is scaled to 0..1 before weighting
+DEFAULT_WEIGHTS = {
+    "rating": 1.0,  # Stars out of 5; unrated stores count as middling
+    "distance": 1.0,  # 1 on the user's doorstep, 0 at the edge of the proximity range
+    "price_fit": 0.5,  # 1 when the budget falls inside the store's price range
+    "closing": 0.5,  # Time left before closing, saturating at CLOSING_HORIZON minutes
+}
+CLOSING_HORIZON = 120
+
+def score_store(catalogue, row, distance, budget, minute, proximity, weights):
+    rating = catalogue.rating[row] / 5 if catalogue.rating[row] else 0.5
+    nearness = max(1 - distance / proximity, 0.0) if proximity else 1.0
+    max_price = catalogue.max_price[row]
+    price_fit = 1.0 if budget <= max_price or not budget else max_price / budget
+    closing = 1.0
+    if minute is not None and catalogue.open_minutes[row] < MINUTES_PER_DAY:
+        minutes_left = catalogue.open_minutes[row] - (minute - catalogue.open_from[row]) % MINUTES_PER_DAY
+        closing = min(minutes_left, CLOSING_HORIZON) / CLOSING_HORIZON
+    return (weights["rating"] * rating + weights["distance"] * nearness
+            + weights["price_fit"] * price_fit + weights["closing"] * closing)
+
+@metrics.timed("recommend.rank")
+def rank_stores(catalogue, budget, time, proximity, cuisine, location=DEFAULT_LOCATION, k=10, cursor=None, weights=None, cache=None, router=None,
+                price_mode=DEFAULT_PRICE_MODE):
+    # The best k matches by score, plus a cursor for the next page (None when there is none).
+    # Only the returned page is selected (heap-based nlargest) and turned into dicts.
+    # With a Router (see routing.py) nearness is scored on travel time rather than distance.
+    k = max(k, 1)
+    return page_of(rank_page(catalogue, budget, time, proximity, cuisine, location, k, cursor, weights, cache, router, price_mode), k)
+
+def rank_page(catalogue, budget, time, proximity, cuisine, location=DEFAULT_LOCATION, k=10, cursor=None, weights=None, cache=None, router=None,
+              price_mode=DEFAULT_PRICE_MODE):
+    # The k + 1 best matches after cursor as (score, row, store), best first; the extra one only
+    # tells whether there is another page. Shards return these so their pages can be merged.
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    minute = parse_minutes(time) if time else None
+    match = cache.match if cache is not None else match_stores
+    matches = match(catalogue, budget, time, proximity, cuisine, location, price_mode)
+    etas = {}
+    if router is not None:
+        rows = [row for _, row in matches]
+        etas = dict(zip(rows, router.etas_from(location, [(catalogue.lat[row], catalogue.lon[row]) for row in rows])))
+        # Travel time stands in for distance as the km covered in that time at city speed
+        nearness = (etas[row] / 3600 * router.average_kph for _, row in matches)
+    else:
+        nearness = (distance for distance, _ in matches)
+    scored = ((score_store(catalogue, row, near, budget, minute, proximity, weights), row, distance)
+              for (distance, row), near in zip(matches, nearness))
+
+    # Pages are ordered by score, highest first, then by row id; the cursor is the last key served
+    if cursor:
+        last_key = cursor_key(cursor)
+        scored = (item for item in scored if (-item[0], item[1]) > last_key)
+    page = heapq.nsmallest(k + 1, scored, key=lambda item: (-item[0], item[1]))
+
+    ranked = []
+    for score, row, distance in page:
+        store = dict(catalogue.row(row), proximity=round(distance, 2), score=round(score, 4))
+        if etas:
+            store["eta_minutes"] = round(etas[row] / 60, 1)
+        ranked.append((score, row, store))
+    return ranked
+
+def cursor_key(cursor):
+    last_score, _, last_row = cursor.partition(":")
+    return -float(last_score), int(last_row)
+
+def page_of(ranked, k):
+    # (stores, next cursor) from the k + 1 best (score, row, store), e.g. merged from several shards
+    next_cursor = f"{ranked[k - 1][0]!r}:{ranked[k - 1][1]}" if len(ranked) > k else None
+    return [store for _, _, store in ranked[:k]], next_cursor
+
+@metrics.timed("search.fuzzy")
+def search_stores(catalogue, text, limit=10):
+    # Stores whose name is closest to text, typos and all, best first
+    return [dict(catalogue.row(row), similarity=round(similarity, 3))
+            for similarity, row in catalogue.name_index().search(text, limit)]
+
+@metrics.timed("search.autocomplete")
+def autocomplete_stores(catalogue, prefix, limit=10):
+    return [catalogue.row(row) for row in catalogue.name_index().complete(prefix, limit)]
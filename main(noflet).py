@@ -1,84 +1,7 @@
-import random
-from math import radians, cos, sin, sqrt, atan2
-import json
-import heapq
-from collections import defaultdict
-
-
-def safe_float(value):
-    try:
-        return float(value) if value else 0.0  # If the value is empty or None, return 0.0
-    except ValueError:
-        return 0.0  # Return a default value of 0.0 for invalid numbers
-
-
-def load_food_stores():
-    with open('eateries.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    food_stores = []
-    stores_by_type = defaultdict(list)
-
-    for record in data:
-        store = {
-            "name": record.get("name", "Unknown"),
-            "type": record.get("cuisine_type", "Unknown Cuisine"),
-            "proximity": float(record.get("proximity", 0)) / 1000,  # Convert meters to kilometers
-            "rating": safe_float(record.get("ratings", "")),  # Use safe_float to handle empty or invalid ratings
-            "fb_page": record.get("fb_page_url", "N/A"),
-            "location_url": record.get("location_url", "N/A"),
-            "time_availability": record.get("time", "N/A"),
-            "min_price": int(record.get("min_price", 0)),
-            "max_price": int(record.get("max_price", 0))
-        }
-        food_stores.append(store)
-        stores_by_type[store["type"].lower()].append(store)
-
-    return food_stores, stores_by_type
-
-
-# Generate random rider data and save to JSON file
-def generate_riders():
-    first_names = ["Juan", "Maria", "Jose", "Anna", "Pedro", "Luis", "Carmen", "Elena"]
-    last_names = ["Dela Cruz", "Santos", "Garcia", "Reyes", "Flores", "Torres", "Ramos", "Morales"]
-
-    riders = []
-    for i in range(10):
-        name = f"{random.choice(first_names)} {random.choice(last_names)}"
-        location = (random.uniform(13.7800, 13.7900), random.uniform(121.0650, 121.0750))
-        proximity = calculate_distance((13.7859177, 121.0706258), location)
-        phone_number = f"+63{random.randint(900000000, 999999999)}"  # Generate random Philippine number
-        riders.append({
-            "name": name,
-            "location": location,
-            "proximity": round(proximity, 2),
-            "availability": random.choice([True, False]),
-            "phone_number": phone_number  # Add phone number to rider's data
-        })
-
-        with open('riders.json', 'w', encoding='utf-8') as f:
-            json.dump(riders, f, indent=4)
-
-        return riders
-
-    # Load riders data from JSON file
-    def load_riders():
-        with open('riders.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-
-
-# Function to calculate distance between two coordinates using Haversine formula
-def calculate_distance(coord1, coord2):
-    R = 6371  # Radius of the Earth in km
-    lat1, lon1 = radians(coord1[0]), radians(coord1[1])
-    lat2, lon2 = radians(coord2[0]), radians(coord2[1])
-
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    distance = R * c
-    return distance
+import metrics
+from core import Services
+from food_store import recommend_stores
+from utils import DEFAULT_LOCATION, PRICE_MODES, PRICE_RANGE
 
 
 # Function to handle user input with validation
@@ -122,43 +45,31 @@ def get_user_input():
         else:
             print("Cuisine type cannot be empty. Please try again.")
 
-    return budget, preferred_time, proximity_range, cuisine_type
-
-
-# Recommend food stores based on user input with optimization
-def recommend_stores(food_stores, stores_by_type, budget, time, proximity, cuisine):
-    # Use pre-indexed stores by type for faster lookup
-    recommendations = []
-    cuisine = cuisine.lower()
-    if cuisine in stores_by_type:
-        # Filter by proximity and budget in the relevant cuisine category
-        for store in stores_by_type[cuisine]:
-            if store["proximity"] <= proximity and store["min_price"] <= budget <= store["max_price"]:
-                recommendations.append(store)
-    return recommendations
-
-# Find available rider nearest to the location
-def find_rider(riders, location):
-    available_riders = [rider for rider in riders if rider["availability"]]
-
-    # Create a heap based on proximity
-    heap = []
-    for rider in available_riders:
-        proximity = rider["proximity"]
-        heapq.heappush(heap, (proximity, rider))  # Push the (proximity, rider) tuple
+    # This front end has always matched budgets against the whole price range, so that stays the default
+    while True:
+        price_mode = input("Match the budget to the store's price range, or only to its cheapest item? "
+                           "(range/entry, Enter for range): ").strip().lower() or PRICE_RANGE
+        if price_mode in PRICE_MODES:
+            break
+        else:
+            print(f"Invalid choice. Please enter one of: {', '.join(PRICE_MODES)}.")
 
-    # Extract the closest rider if available
-    return heapq.heappop(heap)[1] if heap else None
+    return budget, preferred_time, proximity_range, cuisine_type, price_mode
 
 
 # Main program with retry logic
 def main():
-    food_stores, stores_by_type = load_food_stores()
-    riders = generate_riders()
+    metrics.start_from_environment()
+    # Same catalogue, riders and road graph as the Flet app, loaded while the user types
+    services = Services().start()
 
     while True:
-        budget, time, proximity, cuisine = get_user_input()
-        recommended_stores = recommend_stores(food_stores, stores_by_type, budget, time, proximity, cuisine)
+        budget, time, proximity, cuisine, price_mode = get_user_input()
+        if not services.loaded.is_set():
+            print("Loading stores...")
+        services.wait()
+        recommended_stores = recommend_stores(services.food_stores.current, budget, time, proximity, cuisine,
+                                              price_mode=price_mode)
 
         if recommended_stores:
             print("\nHere are your recommended food stores:")
@@ -186,9 +97,13 @@ def main():
 
             need_rider = input("\nDo you need a rider to go to the place? (yes/no): ")
             if need_rider.lower() == "yes":
-                rider = find_rider(riders, (13.7859177, 121.0706258))
-                if rider:
-                    print(f"\nRider {rider['name']} will assist you! \nCurrent location: {rider['proximity']} km away.")
+                # Queue the request for the next dispatch batch, as the Flet app does, so this order
+                # can't be given a rider another front end is assigning at the same moment
+                store_location = (chosen_store['lat'], chosen_store['lon']) if chosen_store['lat'] is not None else DEFAULT_LOCATION
+                assignment = services.dispatcher.request(store_location).result()
+                if assignment:
+                    distance, rider = assignment
+                    print(f"\nRider {rider['name']} will assist you! \nCurrent location: {round(distance, 2)} km away.")
                     print(f"Rider's contact number: {rider['phone_number']}")
                     print("\nAll set! You're ready to Ride&Dine!")
                 else:
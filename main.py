@@ -1,19 +1,33 @@
+import threading
+import metrics
+from core import Services
+
+# Exporter and profiler, if RIDEDINE_METRICS_FILE / RIDEDINE_PROFILE ask for them
+metrics.start_from_environment()
+
+# Catalogue, riders, road graph and dispatcher load in the background (see core.Services) while
+# flet is imported and the window opens; the form shows a loading state until they are ready
+services = Services().start()
+
 import flet as ft
-from food_store import load_food_stores, recommend_stores
-from rider import generate_riders
-from utils import calculate_distance
-import heapq
+from food_store import rank_stores
+from query_cache import QueryCache
+from session import Session
+from utils import DEFAULT_PRICE_MODE, PRICE_ENTRY, PRICE_RANGE
 
-# Store selected food and rider info globally
-selected_store = None
-selected_rider = None
+# Every window searches from the same kiosk location, so their queries share one cache
+query_cache = QueryCache()
 
-# Main page for user input
-def main_page(page: ft.Page):
-    # Load food stores and riders data
-    food_stores, stores_by_type = load_food_stores()
-    riders = generate_riders()
+# Number of recommendations fetched per page; the next page is fetched when the list is scrolled near its end
+PAGE_SIZE = 10
+
+# The result list has a fixed height and fixed row extent, so Flutter only builds the visible rows
+RESULTS_HEIGHT = 360
+ROW_HEIGHT = 48
 
+
+# Main page for user input
+def main_page(page: ft.Page, session: Session):
     # UI Elements for page 1
     budget_input = ft.TextField(label="Enter your budget (e.g., 200)", autofocus=True)
     time_input = ft.TextField(label="Preferred time to eat (HH:MM)", keyboard_type=ft.KeyboardType.NUMBER)
@@ -36,8 +50,21 @@ def main_page(page: ft.Page):
         autofocus=True
     )
 
+    # What "within budget" means for this search (see utils.PRICE_MODES)
+    price_dropdown = ft.Dropdown(
+        label="Budget should cover",
+        options=[
+            ft.dropdown.Option(PRICE_ENTRY, "The store's cheapest item"),
+            ft.dropdown.Option(PRICE_RANGE, "Anything in the store's price range"),
+        ],
+        value=DEFAULT_PRICE_MODE,
+    )
+
     error_message = ft.Column()  # Container for error messages
-    output = ft.Column()
+    loading = ft.Row([ft.ProgressRing(width=16, height=16), ft.Text("Loading stores...")])
+    summary = ft.Text()
+    results = ft.ListView(height=RESULTS_HEIGHT, item_extent=ROW_HEIGHT, scroll_interval=100)
+    fetching = threading.Lock()  # One page fetch at a time, however many scroll events arrive
 
     def validate_inputs():
         # Validate budget, time, and proximity
@@ -86,136 +113,182 @@ def main_page(page: ft.Page):
             elif errors[0][0] == "proximity":
                 proximity_input.focus()  # Correct focus method
 
-            page.update()
+            error_message.update()
             return  # Don't proceed further if there are errors
+        error_message.update()
 
         # Proceed with store recommendations if inputs are valid
         budget = float(budget_input.value)
         preferred_time = time_input.value
         proximity = float(proximity_input.value)
         cuisine = cuisine_dropdown.value.lower()
-
-        recommendations = recommend_stores(food_stores, stores_by_type, budget, preferred_time, proximity, cuisine)
-
-        if recommendations:
-            output.controls.clear()
-            output.controls.append(ft.Text("Recommended food stores list:"))
-            for i, store in enumerate(recommendations):
-                # Pass store data explicitly
-                output.controls.append(
-                    ft.ElevatedButton(f"{store['name']} - {store['type']} - {store['rating']} stars",
-                                      on_click=lambda e, store=store: on_store_select(page, store))
-                )
-            page.update()
-        else:
-            output.controls.clear()
-            output.controls.append(ft.Text("No food stores match your preferences."))
-            page.update()
-
-    submit_button = ft.ElevatedButton("Submit", on_click=on_submit)
-
-    page.add(
+        price_mode = price_dropdown.value or DEFAULT_PRICE_MODE
+
+        # Only the best page of matches is ranked out and rendered; scrolling fetches the next one
+        with fetching:
+            session.query = dict(budget=budget, time=preferred_time, proximity=proximity, cuisine=cuisine, price_mode=price_mode)
+            session.recommendations, session.cursor = rank_stores(services.food_stores.current, **session.query, k=PAGE_SIZE,
+                                                                  cache=query_cache, router=services.router)
+            results.controls = [store_row(store) for store in session.recommendations]
+        summary.value = "Recommended food stores list:" if session.recommendations else "No food stores match your preferences."
+        summary.update()
+        results.update()
+
+    def store_row(store):
+        # Pass store data explicitly
+        return ft.ElevatedButton(f"{store['name']} - {store['type']} - {store['rating']} stars",
+                                 on_click=lambda e, store=store: show_store(store))
+
+    def on_scroll(e):
+        if not session.cursor or e.pixels < e.max_scroll_extent - 2 * ROW_HEIGHT:
+            return
+        if not fetching.acquire(blocking=False):
+            return
+        try:
+            if not session.cursor:  # The last page arrived while this event waited
+                return
+            stores, session.cursor = rank_stores(services.food_stores.current, **session.query, k=PAGE_SIZE, cursor=session.cursor,
+                                                  cache=query_cache, router=services.router)
+            session.recommendations += stores
+            results.controls.extend(store_row(store) for store in stores)
+        finally:
+            fetching.release()
+        results.update()
+
+    results.on_scroll = on_scroll
+    submit_button = ft.ElevatedButton("Submit", on_click=on_submit, disabled=True)
+
+    search_view = ft.Column([
         budget_input,
         time_input,
         proximity_input,
         cuisine_dropdown,
+        price_dropdown,
         submit_button,
+        loading,
         error_message,  # Add error messages container to the page
-        output
-    )
-
-
-# Store selection handler for page 2
-def on_store_select(page: ft.Page, store):
-    global selected_store
-    selected_store = store
-    print(f"Store selected: {store['name']}")  # Debugging print
-
-    # Switch to store details page
-    store_details_page(page)
-
-
-# Store details page
-def store_details_page(page: ft.Page):
-    global selected_store
-
-    if selected_store is None:
-        page.add(ft.Text("No store selected"))
-        return
-
-    # Show selected store details (added hyperlink for urls)
-    store_details = ft.Column([
-        ft.Text(f"You chose {selected_store['name']}!"),
-        ft.Text(f"Google Map Link:{ "" if selected_store['location_url'] else 'N/A'}"),
-        ft.TextButton(text=f"{selected_store['name']}", on_click=lambda _: page.launch_url(selected_store['location_url'])),
-        ft.Text(f"Facebook Page: {selected_store['fb_page']}"),
-        ft.TextButton(text=f"{"Facebook Page" if selected_store['fb_page'] else 'N/A'}", on_click=lambda _: page.launch_url(selected_store['fb_page'] if selected_store['fb_page'] else 'N/A')),
-        ft.Text(f"Rating: {selected_store['rating'] if selected_store['rating'] else 'No rating'} stars"),
-        ft.Text(f"Type: {selected_store['type']}"),
-        ft.Text(f"Proximity: {selected_store['proximity']} km"),
-        ft.Text(f"Time Availability: {selected_store['time_availability'] if selected_store['time_availability'] else 'N/A'}"),]
-        )
-
-    need_rider_button_yes = ft.ElevatedButton("Yes, I need a rider", on_click=lambda e: on_need_rider(page))
-    need_rider_button_no = ft.ElevatedButton("No, I don't need a rider", on_click=lambda e: on_no_rider(page))
-
-    # Clear the current page content and add store details and rider button options
-    page.controls.clear()
-    page.add(store_details, need_rider_button_yes, need_rider_button_no)
-    page.update()
+        summary,
+        results,
+    ])
+    details_view, show_store = store_details_page(page, session, search_view)
+    page.add(search_view, details_view)
+
+    # The form is usable straight away; Submit is enabled once the stores are in memory
+    def wait_for_stores():
+        services.loaded.wait()
+        if services.error is not None:
+            loading.controls = [ft.Text(f"Could not load the stores: {services.error}", color="red")]
+        else:
+            loading.visible = False
+            submit_button.disabled = False
+            submit_button.update()
+        loading.update()
+
+    threading.Thread(target=wait_for_stores, name="ui-loading", daemon=True).start()
+
+
+# Store details page, built once per window and refilled for every selected store. Returns the
+# view and a function that shows it for a store in place of search_view.
+def store_details_page(page: ft.Page, session: Session, search_view):
+    title = ft.Text()
+    map_label = ft.Text()
+    map_link = ft.TextButton(on_click=lambda _: page.launch_url(session.selected_store['location_url']))
+    fb_label = ft.Text()
+    fb_link = ft.TextButton(on_click=lambda _: page.launch_url(session.selected_store['fb_page'] or 'N/A'))
+    rating = ft.Text()
+    store_type = ft.Text()
+    proximity = ft.Text()
+    hours = ft.Text()
+    rider_status = ft.Column()
+
+    def on_store_select(store):
+        session.selected_store = store
+        session.selected_rider = None
+        metrics.count("ui.store_selected")
+
+        # Show selected store details (added hyperlink for urls)
+        title.value = f"You chose {store['name']}!"
+        map_label.value = "Google Map Link:" if store['location_url'] else "Google Map Link:N/A"
+        map_link.text = store['name']
+        fb_label.value = f"Facebook Page: {store['fb_page']}"
+        fb_link.text = "Facebook Page" if store['fb_page'] else 'N/A'
+        rating.value = f"Rating: {store['rating'] if store['rating'] else 'No rating'} stars"
+        store_type.value = f"Type: {store['type']}"
+        proximity.value = f"Proximity: {store['proximity']} km"
+        hours.value = f"Time Availability: {store['time_availability'] if store['time_availability'] else 'N/A'}"
+        rider_status.controls.clear()
+        need_rider_button_yes.disabled = need_rider_button_no.disabled = False
+
+        search_view.visible, details_view.visible = False, True
+        search_view.update()
+        details_view.update()
+
+    def on_back(e):
+        search_view.visible, details_view.visible = True, False
+        details_view.update()
+        search_view.update()
+
+    need_rider_button_yes = ft.ElevatedButton("Yes, I need a rider", on_click=lambda e: on_need_rider(page, session, rider_status, answered))
+    need_rider_button_no = ft.ElevatedButton("No, I don't need a rider", on_click=lambda e: on_no_rider(rider_status, answered))
+
+    def answered():
+        # One answer per selected store, so a double tap can't dispatch two riders
+        need_rider_button_yes.disabled = need_rider_button_no.disabled = True
+        need_rider_button_yes.update()
+        need_rider_button_no.update()
+
+    details_view = ft.Column([
+        title, map_label, map_link, fb_label, fb_link, rating, store_type, proximity, hours,
+        need_rider_button_yes,
+        need_rider_button_no,
+        rider_status,
+        ft.TextButton("Back to results", on_click=on_back),
+    ], visible=False)
+    return details_view, on_store_select
 
 
 # Handle when the user needs a rider
-def on_need_rider(page: ft.Page):
-    global selected_store, selected_rider
-    riders = generate_riders()
+def on_need_rider(page: ft.Page, session: Session, rider_status, answered):
+    selected_store = session.selected_store
 
     # Find the nearest available rider
     if selected_store is None:
         return
+    answered()
+    rider_status.controls = [ft.Text("Finding a rider...")]
+    rider_status.update()
+
+    # Queue the request for the next dispatch batch and wait for the assigned rider
+    try:
+        assignment = services.dispatcher.request((selected_store['lat'], selected_store['lon'])).result()
+    except ValueError:
+        rider_status.controls = [ft.Text("This store has no map location, so no rider can be sent.")]
+        rider_status.update()
+        return
 
-    # Find a rider if needed
-    nearest_rider = find_nearest_rider(riders, selected_store)
-
-    if nearest_rider:
-        selected_rider = nearest_rider
-        rider_details = ft.Column([
+    if assignment:
+        distance, selected_rider = assignment
+        session.selected_rider = selected_rider
+        rider_status.controls = [
             ft.Text(
-                f"Rider: {selected_rider['name']} will assist you! \nCurrent location: {selected_rider['proximity']} km away."),
+                f"Rider: {selected_rider['name']} will assist you! \nCurrent location: {round(distance, 2)} km away."),
             ft.Text(f"Phone: {selected_rider['phone_number']}"),
-        ])
-        page.add(rider_details)
+        ]
+        if services.router:
+            eta = services.router.eta(selected_rider['location'], (selected_store['lat'], selected_store['lon']))
+            rider_status.controls.insert(1, ft.Text(f"Estimated arrival: {round(eta / 60)} min by road"))
     else:
-        page.add(ft.Text("No riders available."))
+        rider_status.controls = [ft.Text("No riders available.")]
 
-    page.add(ft.Text("You're ready to Ride&Dine with your rider!"))
-    page.update()
+    rider_status.controls.append(ft.Text("You're ready to Ride&Dine with your rider!"))
+    rider_status.update()
 
 
 # Handle when the user does not need a rider
-def on_no_rider(page: ft.Page):
-    page.add(ft.Text("You're ready to Ride&Dine!"))
-    page.update()
-
-def find_nearest_rider(riders, store):
-    available_riders = [rider for rider in riders if rider["availability"]]
-
-    if not available_riders:
-        return None
-
-    # Create a heap (min-heap) based on proximity
-    rider_heap = []
-    for rider in available_riders:
-        # Calculate the distance to the store
-        distance = calculate_distance(rider["location"], (13.7859177, 121.0706258))
-
-        # Push a tuple (distance, rider) onto the heap
-        heapq.heappush(rider_heap, (distance, rider))
-
-    # The nearest rider will be the one with the smallest distance
-    nearest_rider = heapq.heappop(rider_heap)[1]  # Pop the rider with the smallest distance
-
-    return nearest_rider
+def on_no_rider(rider_status, answered):
+    answered()
+    rider_status.controls = [ft.Text("You're ready to Ride&Dine!")]
+    rider_status.update()
 
 # Start Flet app
 def main(page: ft.Page):
@@ -223,7 +296,8 @@ def main(page: ft.Page):
     page.window.width = 360
     page.window.height = 720
     page.window.center()
-    main_page(page)
+    # Each window gets its own selection state instead of sharing module globals
+    main_page(page, Session())
 
 # Run the app
-ft.app(target=main)
\ No newline at end of file
+ft.app(target=main)
@@ -0,0 +1,227 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Process-wide counters and latency histograms for the hot paths (load, recommend, dispatch...).
+# Off unless RIDEDINE_METRICS=1 or enable() is called; while off, a timed function costs one
+# extra call and a flag check. Export with write() or an Exporter thread, e.g.
+#   RIDEDINE_METRICS=1 RIDEDINE_METRICS_FILE=metrics.json python service.py
+# and sample where time goes with RIDEDINE_PROFILE=profile.txt (see SamplingProfiler).
+
+# Leaf frames of a thread that is only waiting; samples ending there aren't work
+IDLE_FRAMES = {"threading.py:wait", "selectors.py:select", "queue.py:get"}
+
+# Histogram bucket upper bounds in milliseconds; the last bucket catches everything slower
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+enabled = os.environ.get("RIDEDINE_METRICS") == "1"
+_lock = threading.Lock()
+_counters = Counter()
+_histograms = {}  # Name -> Histogram
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding that share of the samples
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + (self.max_ms,), self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 4) if self.count else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 4),
+            "buckets": {f"le_{bound}": count for bound, count in zip(BUCKETS_MS + ("inf",), self.buckets) if count},
+        }
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def count(name, value=1):
+    if enabled:
+        with _lock:
+            _counters[name] += value
+
+
+def observe(name, seconds):
+    if enabled:
+        with _lock:
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = Histogram()
+            histogram.add(seconds * 1000)
+
+
+def timed(name):
+    # Decorator recording every call's duration under name, and failures under "<name>.errors"
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                count(name + ".errors")
+                raise
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class span:
+    # Times a block: `with metrics.span("dispatch.solve"): ...`
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter() if enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            observe(self.name, time.perf_counter() - self.start)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "time": time.time(),
+            "counters": dict(_counters),
+            "timers": {name: histogram.summary() for name, histogram in sorted(_histograms.items())},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def write(path):
+    data = snapshot()
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4)
+    os.replace(path + ".tmp", path)
+    return data
+
+
+# Rewrites the metrics file every interval seconds, so a spike can be read off while it happens
+class Exporter:
+    def __init__(self, path='metrics.json', interval=10.0):
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        write(self.path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            write(self.path)
+
+
+# Statistical profiler: a background thread looks at every other thread's stack every interval
+# seconds and counts the stacks it sees. Nothing is added to the profiled code, so it can stay on
+# under load. write() emits "outer;inner;leaf count" lines, the collapsed format flame graph
+# tools read.
+class SamplingProfiler:
+    def __init__(self, interval=0.005, depth=30):
+        self.interval = interval
+        self.depth = depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.depth:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if names and names[0] not in IDLE_FRAMES:
+                    self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def top(self, limit=10):
+        # Functions by share of samples they were running in (leaf only)
+        leaves = Counter()
+        for stack, hits in self.stacks.items():
+            leaves[stack.rpartition(";")[2]] += hits
+        total = sum(leaves.values()) or 1
+        return [(name, hits / total) for name, hits in leaves.most_common(limit)]
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, hits in self.stacks.most_common():
+                f.write(f"{stack} {hits}\n")
+
+
+def start_from_environment():
+    # Exporter and profiler as asked for by RIDEDINE_METRICS_FILE and RIDEDINE_PROFILE; the
+    # profile is written when the process exits
+    started = []
+    if enabled and os.environ.get("RIDEDINE_METRICS_FILE"):
+        started.append(Exporter(os.environ["RIDEDINE_METRICS_FILE"]).start())
+    if os.environ.get("RIDEDINE_PROFILE"):
+        profiler = SamplingProfiler().start()
+        atexit.register(lambda: profiler.stop().write(os.environ["RIDEDINE_PROFILE"]))
+        started.append(profiler)
+    return started
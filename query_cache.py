@@ -0,0 +1,136 @@
+import threading
+import metrics
+from array import array
+from collections import OrderedDict
+from itertools import compress, repeat
+from math import ceil
+from operator import and_, ge, lt, mod, or_, sub
+from time import monotonic
+from spatial import geohash, geohash_bounds
+from utils import calculate_distance, distances_from_vectors, parse_minutes, DEFAULT_LOCATION, DEFAULT_PRICE_MODE, MINUTES_PER_DAY, PRICE_RANGE
+
+
+# Shared candidate lists for similar recommendation queries. Requests are quantised to a geohash
+# cell and a proximity step (optionally also a budget bucket and a time slot), and each entry
+# holds every store that can match *any* request in that bucket: the radius is rounded up to the
+# step and widened by the cell's half-diagonal, the budget is rounded up and a store counts as open
+# if it is open at some point of the slot. A hit only re-checks that
+# short list against the exact request, so answers are the same as an uncached match_stores().
+#
+# It pays off where queries repeat, e.g. kiosks searching from fixed spots (bench.py's
+# recommend_kiosk stages); spread-out citywide traffic rarely repeats a key and each miss costs a
+# wider search than an uncached query, so the service only uses it with --cache.
+#
+# Entries carry the catalogue version they were built from; the first query against a new
+# version drops the whole cache, so a reload never serves old prices or hours.
+class QueryCache:
+    def __init__(self, max_entries=2048, ttl=60.0, geohash_precision=6, proximity_step=1.0, budget_step=None, time_step=None):
+        self.max_entries = max_entries
+        self.ttl = ttl  # Seconds an entry is served for, None to keep it until evicted
+        self.geohash_precision = geohash_precision  # 6 is a cell of about 1.2 x 0.6 km
+        self.proximity_step = proximity_step  # Km
+        # Budget and time are left out of the key unless given a step: the price and hours checks
+        # in refine() are cheap, and every extra key part makes repeats rarer
+        self.budget_step = budget_step
+        self.time_step = time_step  # Minutes per time slot
+        self.entries = OrderedDict()  # Key -> (expires, candidates), least recently used first
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def key(self, budget, minute, proximity, code, location, price_mode=DEFAULT_PRICE_MODE):
+        budget_bucket = ceil(budget / self.budget_step) if self.budget_step else None
+        slot = minute // self.time_step if self.time_step and minute is not None else None
+        reach = ceil(proximity / self.proximity_step) * self.proximity_step
+        return (code, geohash(location[0], location[1], self.geohash_precision), budget_bucket, slot, reach, price_mode)
+
+    def match(self, catalogue, budget, time, proximity, cuisine, location=DEFAULT_LOCATION, price_mode=DEFAULT_PRICE_MODE):
+        # Same result as food_store.match_stores(): (distance_km, row) for every matching store
+        code = catalogue.find_cuisine(cuisine)
+        if code is None:
+            return []
+        minute = parse_minutes(time) if time else None
+        key = self.key(budget, minute, proximity, code, location, price_mode)
+
+        with self.lock:
+            if catalogue.version != self.version:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.version = catalogue.version
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > monotonic()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                metrics.count("cache.hits")
+                candidates = entry[1]
+            else:
+                self.misses += 1
+                metrics.count("cache.misses")
+                candidates = None
+
+        if candidates is None:
+            candidates = self.candidates(catalogue, code, key)
+            with self.lock:
+                # A reload may have landed while the candidates were built; don't file them under it
+                if catalogue.version == self.version:
+                    self.entries[key] = (monotonic() + self.ttl if self.ttl is not None else None, candidates)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                        self.evictions += 1
+
+        return self.refine(candidates, budget, minute, proximity, location, price_mode)
+
+    def candidates(self, catalogue, code, key):
+        # Every store that could match some request falling under key
+        _, cell, budget_bucket, slot, radius, price_mode = key
+        min_lat, max_lat, min_lon, max_lon = geohash_bounds(cell)
+        center = ((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+        reach = radius + calculate_distance(center, (max_lat, max_lon))
+        if budget_bucket is None:
+            rows, _ = catalogue.within(code, center, reach)
+        else:
+            # Affordable at the top of the bucket, and for "range" priced up to at least its bottom
+            rows, _ = catalogue.within(code, center, reach, budget_bucket * self.budget_step)
+        mask = repeat(True, len(rows))
+        if budget_bucket is not None and price_mode == PRICE_RANGE:
+            mask = map(ge, map(catalogue.max_price.__getitem__, rows), repeat((budget_bucket - 1) * self.budget_step))
+        if slot is not None:
+            slot_start = slot * self.time_step
+            # Open at the start of the slot, or opening some time during it
+            opens_in_slot = map(lt, map(mod, map(sub, map(catalogue.open_from.__getitem__, rows), repeat(slot_start)),
+                                        repeat(MINUTES_PER_DAY)), repeat(self.time_step))
+            mask = map(and_, mask, map(or_, catalogue.open_at(rows, slot_start), opens_in_slot))
+        rows = array('I', compress(rows, mask))
+        # The columns refine() reads are gathered once here, so a hit doesn't index the catalogue
+        vectors = list(zip(map(catalogue.x.__getitem__, rows), map(catalogue.y.__getitem__, rows), map(catalogue.z.__getitem__, rows)))
+        return (rows, vectors, array('i', map(catalogue.min_price.__getitem__, rows)), array('i', map(catalogue.max_price.__getitem__, rows)),
+                array('h', map(catalogue.open_from.__getitem__, rows)), array('h', map(catalogue.open_minutes.__getitem__, rows)))
+
+    def refine(self, candidates, budget, minute, proximity, location, price_mode=DEFAULT_PRICE_MODE):
+        rows, vectors, min_prices, max_prices, open_from, open_minutes = candidates
+        distances = distances_from_vectors(location, vectors)
+        mask = map(and_, map(ge, repeat(proximity), distances), map(ge, repeat(budget), min_prices))
+        if price_mode == PRICE_RANGE:
+            mask = map(and_, mask, map(ge, max_prices, repeat(budget)))
+        if minute is not None:
+            since_opening = map(mod, map(sub, repeat(minute), open_from), repeat(MINUTES_PER_DAY))
+            mask = map(and_, mask, map(lt, since_opening, open_minutes))
+        return list(compress(zip(distances, rows), mask))
@@ -1,8 +1,17 @@
+import heapq
 import random
+import metrics
 import json
-from utils import calculate_distance
+import os
+import tempfile
+import threading
+import time
+from spatial import GridIndex
+from utils import calculate_distance, parse_location, DEFAULT_LOCATION
 
-def generate_riders():
+@metrics.timed("riders.generate")
+def generate_riders(path='riders.json'):
+    # Writes the riders to path as well, unless path is None
     first_names = ["Juan", "Maria", "Jose", "Anna", "Pedro", "Luis", "Carmen", "Elena"]
     last_names = ["Dela Cruz", "Santos", "Garcia", "Reyes", "Flores", "Torres", "Ramos", "Morales"]
 
@@ -10,21 +19,265 @@ def generate_riders():
     for i in range(10):
         name = f"{random.choice(first_names)} {random.choice(last_names)}"
         location = (random.uniform(13.7800, 13.7900), random.uniform(121.0650, 121.0750))
-        proximity = calculate_distance((13.7859177, 121.0706258), location)
+        proximity = calculate_distance(DEFAULT_LOCATION, location)
         phone_number = f"+63{random.randint(900000000, 999999999)}"
         riders.append({
+            "id": phone_number,
             "name": name,
             "location": location,
             "proximity": round(proximity, 2),
             "availability": random.choice([True, False]),
             "phone_number": phone_number
         })
-        with open('riders.json', 'w', encoding='utf-8') as f:
+
+    if path is not None:
+        with open(path, 'w', encoding='utf-8') as f:
             json.dump(riders, f, indent=4)
 
-        return riders
+    return riders
 
     # Load riders data from JSON file
-def load_riders():
-    with open('riders.json', 'r', encoding='utf-8') as f:
+@metrics.timed("riders.load")
+def load_riders(path='riders.json'):
+    with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
+
+# Keys a message can't carry: they would clash with RiderRegistry.update's own parameters
+RESERVED_KEYS = {"self", "rider_id", "heartbeat"}
+
+# Rider id of a feed or API message, after checking the message could be applied as a whole;
+# raises ValueError otherwise, so a bad message never leaves a half-updated rider
+def check_message(message):
+    if not isinstance(message, dict):
+        raise ValueError(f"Rider update must be an object: {message!r}")
+    rider_id = message.get("id") or message.get("phone_number")
+    if rider_id is not None and not isinstance(rider_id, (str, int)):
+        raise ValueError(f"Rider id must be a string: {rider_id!r}")
+    reserved = RESERVED_KEYS & message.keys()
+    if reserved:
+        raise ValueError(f"Rider update can't set {', '.join(sorted(reserved))}")
+    # A real boolean only: "false" would otherwise count as available
+    if message.get("availability") is not None and not isinstance(message["availability"], bool):
+        raise ValueError(f"Rider availability must be true, false or null: {message['availability']!r}")
+    if message.get("location") is not None:
+        parse_location(message["location"])
+    return rider_id
+
+# Registry loaded from its riders file, seeded with generated riders when there are none yet.
+# The seed is saved through the registry, so it lands in registry.path rather than ./riders.json.
+def load_fleet(registry=None):
+    registry = (registry if registry is not None else RiderRegistry()).load()
+    if not len(registry):
+        for rider in generate_riders(path=None):
+            registry.update(rider["id"], **rider)
+        registry.snapshot()
+    return registry
+
+
+# Long-lived, in-memory rider fleet. Position and availability updates arrive through update()
+# or as JSON lines appended to a feed file, e.g.
+#   {"id": "+63912345678", "location": [13.78, 121.07], "availability": true}
+# Available riders are kept in a GridIndex keyed by rider id, so a position ping is an O(1) cell
+# move, and the fleet is written back to riders.json every snapshot_interval seconds instead of
+# on every request.
+#
+# With a ttl, every update from a rider is a heartbeat and a rider not heard from for ttl seconds
+# drops out of the available set until the next one. Deadlines sit in a heap with at most one
+# entry per rider, so expiring costs only the entries that came due, never a scan of the fleet.
+class RiderRegistry:
+    def __init__(self, path='riders.json', feed_path='rider_updates.jsonl', snapshot_interval=30.0, poll_interval=1.0,
+                 ttl=None):
+        self.path = path
+        self.feed_path = feed_path
+        self.snapshot_interval = snapshot_interval
+        self.poll_interval = poll_interval
+        self.ttl = ttl  # Seconds without a heartbeat before a rider stops being offered, None to never expire
+        self.riders = {}  # Rider id -> rider dict
+        self.available = GridIndex()  # Positions of available, live riders only
+        self.deadlines = {}  # Rider id -> monotonic time its last heartbeat runs out
+        self.expiry = []  # Heap of (deadline, rider id); an entry may be older than the rider's deadline
+        self.expired = 0
+        self.lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()
+        self.dirty = False
+        self.feed_offset = 0
+        self.last_snapshot = time.monotonic()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.riders)
+
+    def load(self):
+        # Loaded riders count as just heard from, so a restart doesn't empty the fleet for a ttl
+        if self.path is not None and os.path.exists(self.path):
+            for rider in load_riders(self.path):
+                self.update(rider.get("id") or rider["phone_number"], **rider)
+            self.dirty = False
+        return self
+
+    @metrics.timed("riders.update")
+    def update(self, rider_id, location=None, availability=None, heartbeat=True, **fields):
+        # heartbeat=False for changes made on the rider's behalf, e.g. the Dispatcher taking them.
+        # A bad location raises ValueError before anything is changed.
+        if location is not None:
+            location = parse_location(location)
+        with self.lock:
+            rider = self.riders.get(rider_id)
+            if rider is None:
+                rider = self.riders[rider_id] = {"id": rider_id, "location": None, "availability": False}
+            rider.update(fields, id=rider_id)
+            if location is not None:
+                rider["location"] = location
+                rider["proximity"] = round(calculate_distance(DEFAULT_LOCATION, rider["location"]), 2)
+            if availability is not None:
+                rider["availability"] = bool(availability)
+            if heartbeat and self.ttl is not None:
+                self._heartbeat(rider_id, time.monotonic())
+
+            if rider["availability"] and rider["location"] is not None and self._live(rider_id):
+                self.available.move(rider_id, *rider["location"])
+            else:
+                self.available.remove(rider_id)
+            self.dirty = True
+            return rider
+
+    def _heartbeat(self, rider_id, now):
+        # A rider already in the heap keeps its entry; expire() re-files it under the new deadline
+        if rider_id not in self.deadlines:
+            heapq.heappush(self.expiry, (now + self.ttl, rider_id))
+        self.deadlines[rider_id] = now + self.ttl
+
+    def _live(self, rider_id):
+        return self.ttl is None or rider_id in self.deadlines
+
+    def expire(self, now=None):
+        # Takes riders whose last heartbeat is more than ttl old out of the available set
+        if self.ttl is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        expired = 0
+        with self.lock:
+            while self.expiry and self.expiry[0][0] <= now:
+                _, rider_id = heapq.heappop(self.expiry)
+                deadline = self.deadlines.get(rider_id)
+                if deadline is None:
+                    continue
+                if deadline > now:
+                    heapq.heappush(self.expiry, (deadline, rider_id))  # Heard from since this entry was filed
+                    continue
+                del self.deadlines[rider_id]
+                self.available.remove(rider_id)
+                expired += 1
+            self.expired += expired
+        if expired:
+            metrics.count("riders.expired", expired)
+        return expired
+
+    def remove(self, rider_id):
+        with self.lock:
+            rider = self.riders.pop(rider_id, None)
+            if rider is not None:
+                self.available.remove(rider_id)
+                self.dirty = True
+            return rider
+
+    def apply(self, message):
+        # ValueError (see check_message) for a malformed message, None for one without an id
+        rider_id = check_message(message)
+        if not rider_id:
+            return None
+        if message.get("removed"):
+            return self.remove(rider_id)
+        return self.update(rider_id, **{key: value for key, value in message.items() if key not in ("id", "removed")})
+
+    def available_riders(self):
+        self.expire()
+        with self.lock:
+            return [self.riders[rider_id] for rider_id in self.available]
+
+    @metrics.timed("riders.nearest")
+    def nearest_available(self, location, k=3, max_km=None):
+        # Up to k available riders closest to location (e.g. the chosen store) as (distance_km, rider),
+        # nearest first; the runners-up are the fallbacks if the first rider can't take the order
+        self.expire()
+        with self.lock:
+            return [(distance, self.riders[rider_id])
+                    for distance, rider_id in self.available.nearest(location[0], location[1], k, max_km)]
+
+    @metrics.timed("riders.feed")
+    def follow_feed(self):
+        # Applies every complete line appended to the feed since the last call
+        try:
+            with open(self.feed_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < self.feed_offset:
+                    self.feed_offset = 0  # The feed was truncated or rotated
+                f.seek(self.feed_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+
+        # A trailing line without a newline is still being written; pick it up next time
+        complete = data[:data.rfind(b"\n") + 1]
+        self.feed_offset += len(complete)
+        applied = 0
+        for line in complete.splitlines():
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            try:
+                if self.apply(message) is not None:
+                    applied += 1
+            except Exception as e:
+                # One bad line must not hold back the lines after it
+                print(f"Rider update skipped: {e!r}")
+        return applied
+
+    def export(self):
+        # Copies of every rider, as written to riders.json
+        return [dict(rider) for rider in self.riders.values()]
+
+    @metrics.timed("riders.snapshot")
+    def snapshot(self):
+        with self._snapshot_lock:
+            with self.lock:
+                if not self.dirty or self.path is None:  # No path: an in-memory registry, e.g. a shard's
+                    return False
+                riders = self.export()
+                self.dirty = False
+            # Written to a temp file of its own beside the target and renamed, so readers never see a
+            # half-written file and two processes saving the same fleet don't write into one file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=os.path.basename(self.path) + ".",
+                                             suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(riders, f, indent=4)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.unlink(temp_path)
+                self.dirty = True  # Not saved, so the next snapshot tries again
+                raise
+            self.last_snapshot = time.monotonic()
+            return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rider-registry", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.snapshot()
+
+    def _run(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.follow_feed()
+                self.expire()
+                if time.monotonic() - self.last_snapshot >= self.snapshot_interval:
+                    self.snapshot()
+            except Exception as e:
+                # e.g. an unreadable feed or a full disk; keep the feed, expiry and snapshots going
+                print(f"Rider registry step failed: {e!r}")
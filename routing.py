@@ -0,0 +1,256 @@
+import heapq
+import metrics
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from xml.etree import ElementTree
+from spatial import GridIndex, cell_of
+from utils import calculate_distance
+
+# Typical speeds in km/h for OSM highway classes in Batangas city traffic, used when a way has
+# no maxspeed tag
+HIGHWAY_SPEEDS = {
+    "motorway": 60, "motorway_link": 40, "trunk": 45, "trunk_link": 30,
+    "primary": 35, "primary_link": 25, "secondary": 30, "secondary_link": 25,
+    "tertiary": 25, "tertiary_link": 20, "unclassified": 20, "road": 20,
+    "residential": 15, "living_street": 10, "service": 10,
+}
+ACCESS_KPH = 12  # Getting from a point to the nearest road node and back off it at the other end
+AVERAGE_KPH = 20  # Door-to-door city average, for turning travel times back into distances
+DETOUR = 1.4  # Typical road distance over straight-line distance
+
+
+# Road network as compressed adjacency arrays (one pair for each direction), with travel time in
+# seconds as the edge weight. Node positions are also kept in a GridIndex to snap points to roads.
+class RoadGraph:
+    def __init__(self, lats, lons, edges):
+        # edges: (from node, to node, seconds); one-way streets simply have no reverse edge
+        self.lats = array('d', lats)
+        self.lons = array('d', lons)
+        edges = list(edges)
+        self.forward = self._adjacency(edges, reverse=False)
+        self.backward = self._adjacency(edges, reverse=True)
+        # Fastest speed on any edge in km/s keeps the A* heuristic admissible
+        self.max_speed = max((calculate_distance((self.lats[a], self.lons[a]), (self.lats[b], self.lons[b])) / seconds
+                              for a, b, seconds in edges if seconds > 0), default=1.0) or 1.0
+        self.nodes = GridIndex(cell_km=0.25)
+        for node in range(len(self.lats)):
+            self.nodes.insert(node, self.lats[node], self.lons[node])
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _adjacency(self, edges, reverse):
+        counts = [0] * (len(self.lats) + 1)
+        for a, b, _ in edges:
+            counts[(b if reverse else a) + 1] += 1
+        for node in range(len(self.lats)):
+            counts[node + 1] += counts[node]
+        starts = array('I', counts)
+        targets = array('I', bytes(4 * len(edges)))
+        seconds = array('f', bytes(4 * len(edges)))
+        slot = list(counts)
+        for a, b, weight in edges:
+            source, target = (b, a) if reverse else (a, b)
+            targets[slot[source]] = target
+            seconds[slot[source]] = weight
+            slot[source] += 1
+        return starts, targets, seconds
+
+    def snap(self, lat, lon):
+        # (distance_km, node) of the closest road node, or None for an empty graph
+        nearest = self.nodes.nearest(lat, lon, 1)
+        return nearest[0] if nearest else None
+
+    @metrics.timed("routing.astar")
+    def shortest_time(self, source, target):
+        # Point-to-point A* on travel time; seconds, or None when target can't be reached
+        starts, targets, seconds = self.forward
+        goal = (self.lats[target], self.lons[target])
+        best = {source: 0.0}
+        frontier = [(0.0, 0.0, source)]
+        while frontier:
+            _, elapsed, node = heapq.heappop(frontier)
+            if node == target:
+                return elapsed
+            if elapsed > best[node]:
+                continue
+            for i in range(starts[node], starts[node + 1]):
+                neighbour, time = targets[i], elapsed + seconds[i]
+                if time < best.get(neighbour, float("inf")):
+                    best[neighbour] = time
+                    remaining = calculate_distance((self.lats[neighbour], self.lons[neighbour]), goal) / self.max_speed
+                    heapq.heappush(frontier, (time + remaining, time, neighbour))
+        return None
+
+    def times_from(self, source, reverse=False, horizon=None, start=0.0):
+        # One-to-many Dijkstra: {node: seconds} from source, or to source when reverse is set,
+        # for every node reachable within horizon seconds
+        starts, targets, seconds = self.backward if reverse else self.forward
+        best = {source: start}
+        frontier = [(start, source)]
+        while frontier:
+            elapsed, node = heapq.heappop(frontier)
+            if elapsed > best[node]:
+                continue
+            for i in range(starts[node], starts[node + 1]):
+                neighbour, time = targets[i], elapsed + seconds[i]
+                if (horizon is None or time <= horizon) and time < best.get(neighbour, float("inf")):
+                    best[neighbour] = time
+                    heapq.heappush(frontier, (time, neighbour))
+        return best
+
+
+def road_graph_from_json(data):
+    # {"nodes": [[lat, lon], ...], "edges": [[from, to, speed_kph, oneway], ...]}
+    lats = [node[0] for node in data["nodes"]]
+    lons = [node[1] for node in data["nodes"]]
+    edges = []
+    for a, b, speed, oneway in data["edges"]:
+        seconds = calculate_distance((lats[a], lons[a]), (lats[b], lons[b])) / speed * 3600
+        edges.append((a, b, seconds))
+        if not oneway:
+            edges.append((b, a, seconds))
+    return RoadGraph(lats, lons, edges)
+
+
+def road_graph_from_osm(path):
+    # Drivable ways from an OSM XML extract (e.g. exported for Batangas from openstreetmap.org)
+    positions, ways = {}, []
+    for _, element in ElementTree.iterparse(path):
+        if element.tag == "node":
+            positions[element.get("id")] = (float(element.get("lat")), float(element.get("lon")))
+        elif element.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+            if tags.get("highway") in HIGHWAY_SPEEDS:
+                ways.append(([nd.get("ref") for nd in element.iter("nd")], tags))
+            element.clear()
+
+    index, lats, lons, edges = {}, [], [], []
+    for refs, tags in ways:
+        speed = HIGHWAY_SPEEDS[tags["highway"]]
+        try:
+            speed = min(float(tags.get("maxspeed", "").split()[0]), speed)
+        except (IndexError, ValueError):
+            pass
+        oneway = tags.get("oneway") in ("yes", "true", "1")
+        for a, b in zip(refs, refs[1:]):
+            if a not in positions or b not in positions:
+                continue
+            for ref in (a, b):
+                if ref not in index:
+                    index[ref] = len(lats)
+                    lats.append(positions[ref][0])
+                    lons.append(positions[ref][1])
+            seconds = calculate_distance(positions[a], positions[b]) / speed * 3600
+            edges.append((index[a], index[b], seconds))
+            if not oneway:
+                edges.append((index[b], index[a], seconds))
+    return RoadGraph(lats, lons, edges)
+
+
+@metrics.timed("routing.load")
+def load_road_graph(path='roads.json'):
+    if path.endswith(".osm"):
+        return road_graph_from_osm(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        return road_graph_from_json(json.load(f))
+
+
+# Travel-time estimates for ranking riders and stores. Each location gets one bounded Dijkstra,
+# boiled down to the fastest time per grid cell and kept in an LRU of tables, so after the first
+# query an ETA from anywhere nearby is a dict lookup. Places outside the horizon fall back to A*.
+class Router:
+    def __init__(self, graph, cell_km=0.25, horizon=900.0, max_tables=512):
+        self.graph = graph
+        self.cell_km = cell_km
+        self.horizon = horizon  # Seconds covered by one table
+        self.max_tables = max_tables
+        self.average_kph = AVERAGE_KPH
+        self.tables = OrderedDict()  # (cell, reverse) -> {cell: seconds}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @metrics.timed("routing.table")
+    def table(self, location, reverse=False):
+        # {cell: seconds} from location to every cell within the horizon, or from every cell to
+        # location when reverse is set. Locations sharing a cell share a table.
+        key = (cell_of(location[0], location[1], self.cell_km), reverse)
+        with self.lock:
+            table = self.tables.get(key)
+            if table is not None:
+                self.tables.move_to_end(key)
+                self.hits += 1
+                return table
+            self.misses += 1
+
+        graph = self.graph
+        snapped = graph.snap(*location)
+        table = {}
+        if snapped is None:  # No roads at all; every lookup falls back to beyond() or the straight line
+            return table
+        snap_km, node = snapped
+        for reached, seconds in graph.times_from(node, reverse, self.horizon, snap_km / ACCESS_KPH * 3600).items():
+            cell = cell_of(graph.lats[reached], graph.lons[reached], self.cell_km)
+            if seconds < table.get(cell, float("inf")):
+                table[cell] = seconds
+        with self.lock:
+            self.tables[key] = table
+            while len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False)
+        return table
+
+    def lookup(self, table, location):
+        row, col = cell_of(location[0], location[1], self.cell_km)
+        seconds = table.get((row, col))
+        if seconds is None:
+            # Sparse road data can leave a cell without a node; borrow the best neighbouring
+            # cell plus the time to cross into it
+            around = [table.get((row + dr, col + dc)) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+            around = [value for value in around if value is not None]
+            if around:
+                seconds = min(around) + self.cell_km / ACCESS_KPH * 3600
+        return seconds
+
+    def eta(self, origin, destination):
+        # Seconds to travel from origin to destination
+        seconds = self.lookup(self.table(destination, reverse=True), origin)
+        if seconds is not None:
+            return seconds
+        origin_snap, destination_snap = self.graph.snap(*origin), self.graph.snap(*destination)
+        seconds = None
+        if origin_snap is not None and destination_snap is not None:
+            (origin_km, source), (destination_km, target) = origin_snap, destination_snap
+            seconds = self.graph.shortest_time(source, target)
+        if seconds is None:
+            # Not connected by road in this graph; assume a slow, roundabout straight line
+            return calculate_distance(origin, destination) * DETOUR / ACCESS_KPH * 3600
+        return seconds + (origin_km + destination_km) / ACCESS_KPH * 3600
+
+    def beyond(self, origin, destination):
+        # Anything the table doesn't reach is at least a horizon away; estimating it rather than
+        # running A* keeps batch lookups cheap when most candidates are out of reach anyway
+        return max(self.horizon, calculate_distance(origin, destination) * DETOUR / self.average_kph * 3600)
+
+    def etas_to(self, origins, destination):
+        # Seconds from each origin (e.g. riders) to one destination, sharing its table
+        table = self.table(destination, reverse=True)
+        return [seconds if seconds is not None else self.beyond(origin, destination)
+                for origin, seconds in zip(origins, (self.lookup(table, origin) for origin in origins))]
+
+    def etas_from(self, origin, destinations):
+        table = self.table(origin)
+        return [seconds if seconds is not None else self.beyond(origin, destination)
+                for destination, seconds in zip(destinations, (self.lookup(table, destination) for destination in destinations))]
+
+
+def load_router(path='roads.json'):
+    # Routing is optional: without a road graph (or with one holding no roads) everything keeps
+    # ranking by straight-line distance
+    if not os.path.exists(path):
+        return None
+    graph = load_road_graph(path)
+    return Router(graph) if len(graph) else None
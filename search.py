@@ -0,0 +1,157 @@
+import copy
+import heapq
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+NON_WORD = re.compile(r"[^0-9a-z]+")
+
+# Words that say nothing about which cuisine is meant ("Korean Restaurant" is just "korean")
+CUISINE_STOP_WORDS = {"restaurant", "restaurants", "resto", "shop", "house"}
+
+
+def normalize(text, stop_words=()):
+    words = NON_WORD.sub(" ", (text or "").lower()).split()
+    return " ".join(word for word in words if word not in stop_words) or " ".join(words)
+
+
+def trigrams(normalized):
+    # Each word is padded so short words and word starts still produce grams, e.g. "pizza" ->
+    # "  p", " pi", "piz", "izz", "zza", "za "
+    grams = set()
+    for word in normalized.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+# Inverted trigram index with a sorted phrase list for prefix completion. Lookups only touch the
+# posting lists of the query's own trigrams (or a bisect range of phrases), never every entry.
+class TrigramIndex:
+    def __init__(self, stop_words=()):
+        self.stop_words = stop_words
+        self.keys = []  # Entry -> caller's key, e.g. a catalogue row
+        self.gram_counts = []  # Entry -> number of distinct trigrams
+        self.postings = defaultdict(list)  # Trigram -> entries containing it
+        self.phrases = []  # Sorted (phrase, entry) for every word position of every entry
+        self.removed = set()  # Keys still in the postings but no longer returned
+        self.removed_grams = Counter()  # Trigram -> removed entries still in its posting list
+        self._sorted = True
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, text, key):
+        normalized = normalize(text, self.stop_words)
+        entry = len(self.keys)
+        self.keys.append(key)
+        grams = trigrams(normalized)
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(entry)
+        # "jollibee batangas" completes from "jol" and from "bat"
+        words = normalized.split()
+        self.phrases.extend((" ".join(words[i:]), entry) for i in range(len(words)))
+        self._sorted = False
+
+    def extended(self, items, removed=()):
+        # A copy with the (text, key) items added and the removed (text, key) items hidden, which
+        # answers exactly as an index built from the remaining items would. Posting lists the new
+        # items don't touch are shared with this index, which stays unchanged for readers still
+        # using it; the cost is a copy of the entry lists, not a rebuild.
+        index = copy.copy(self)
+        index.keys = list(self.keys)
+        index.gram_counts = list(self.gram_counts)
+        index.postings = defaultdict(list, self.postings)
+        index.phrases = list(self.phrases)
+        index.removed = set(self.removed)
+        index.removed_grams = Counter(self.removed_grams)
+        for text, key in removed:
+            index.removed.add(key)
+            index.removed_grams.update(trigrams(normalize(text, self.stop_words)))
+        copied = set()
+        for text, key in items:
+            grams = trigrams(normalize(text, self.stop_words)) - copied
+            for gram in grams:
+                index.postings[gram] = list(self.postings.get(gram, ()))
+            copied |= grams
+            index.add(text, key)
+        index.sort()
+        return index
+
+    def search(self, text, limit=10, min_similarity=0.3):
+        # [(similarity, key)] best first; similarity is the Dice coefficient of the trigram sets.
+        # Candidates come from the query's rarer trigrams only; grams found in a large share of
+        # the entries (think " st" in "Store ...") are then counted for the best candidates by
+        # bisecting their sorted posting lists, so a search never walks a huge posting list.
+        grams = trigrams(normalize(text, self.stop_words))
+        if not grams or not self.keys:
+            return []
+        # Sizes leave out removed entries, so rare and common split as in a freshly built index
+        keys, removed = self.keys, self.removed
+        common_size = max(256, (len(keys) - len(removed)) // 20)
+        postings = [(self.postings[gram], len(self.postings[gram]) - self.removed_grams[gram])
+                    for gram in grams if gram in self.postings]
+        rare = [entries for entries, size in postings if 0 < size <= common_size]
+        common = [entries for entries, size in postings if size > common_size]
+        if not rare:
+            rare, common = common, []
+
+        shared = defaultdict(int)
+        for entries in rare:
+            for entry in entries:
+                shared[entry] += 1
+        if removed:
+            shared = {entry: count for entry, count in shared.items() if keys[entry] not in removed}
+        if common:
+            for count, entry in heapq.nlargest(max(limit * 20, 200), ((count, entry) for entry, count in shared.items())):
+                for entries in common:
+                    i = bisect_left(entries, entry)
+                    if i < len(entries) and entries[i] == entry:
+                        shared[entry] += 1
+
+        query_count = len(grams)
+        scored = ((2 * count / (query_count + self.gram_counts[entry]), entry) for entry, count in shared.items())
+        best = heapq.nlargest(limit, scored)
+        return [(similarity, self.keys[entry]) for similarity, entry in best if similarity >= min_similarity]
+
+    def sort(self):
+        if not self._sorted:
+            self.phrases.sort()
+            self._sorted = True
+
+    def best(self, text, min_similarity=0.5):
+        matches = self.search(text, 1, min_similarity)
+        return matches[0][1] if matches else None
+
+    def complete(self, prefix, limit=10):
+        # Keys of the entries with a word starting a phrase that begins with prefix, in phrase order
+        prefix = normalize(prefix, ())
+        if not prefix:
+            return []
+        self.sort()
+        keys, seen = [], set()
+        for i in range(bisect_left(self.phrases, (prefix,)), len(self.phrases)):
+            phrase, entry = self.phrases[i]
+            if not phrase.startswith(prefix) or len(keys) >= limit:
+                break
+            if entry not in seen and self.keys[entry] not in self.removed:
+                seen.add(entry)
+                keys.append(self.keys[entry])
+        return keys
+
+
+def build_name_index(catalogue):
+    index = TrigramIndex()
+    for row, name in enumerate(catalogue.names):
+        if row not in catalogue.deleted:
+            index.add(name, row)
+    index.sort()  # Now rather than on the first keystroke
+    return index
+
+
+def build_cuisine_index(catalogue):
+    index = TrigramIndex(CUISINE_STOP_WORDS)
+    for code, label in enumerate(catalogue.cuisines):
+        index.add(label, code)
+    return index
@@ -0,0 +1,298 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from math import isfinite
+from urllib.parse import parse_qs, urlsplit
+import metrics
+from dispatch import Dispatcher
+from food_store import autocomplete_stores, cursor_key, rank_stores, search_stores
+from query_cache import QueryCache
+from rider import check_message, load_fleet, RiderRegistry
+from routing import load_router
+from session import SessionStore
+from sharding import ShardedRiders, ShardPool
+from utils import parse_location, parse_minutes, DEFAULT_LOCATION, DEFAULT_PRICE_MODE, PRICE_MODES
+from watcher import LiveCatalogue
+
+# Headless Ride&Dine over HTTP/JSON, built on asyncio streams only. One process serves every
+# kiosk: the catalogue, rider fleet and dispatcher are shared, and each client keeps its picks
+# in a session instead of module globals.
+#
+#   POST /sessions                          -> {"session": id}
+#   GET  /recommend?budget=&time=&proximity=&cuisine=[&lat=&lon=][&limit=][&cursor=][&price=entry|range][&session=]
+#                                           -> {"stores": [...best first], "next": cursor or null}
+#   GET  /stores/<id>
+#   GET  /search?q=[&limit=]                -> {"stores": [...closest name first, with "similarity"]}
+#   GET  /autocomplete?q=[&limit=]          -> {"stores": [...names starting a word with q]}
+#   POST /sessions/<id>/store   {"store": <id>}
+#   POST /sessions/<id>/rider               -> {"rider": {...}, "distance_km": d[, "eta_minutes": m]} or {"rider": null}
+#   POST /riders                {"id": ..., "location": [lat, lon], "availability": true} or a list of them
+#   GET  /stats                             -> {"cache": {"hits": ..., "misses": ..., ...} or null without --cache}
+#   GET  /metrics                           -> counters and latency histograms (RIDEDINE_METRICS=1)
+
+MAX_BODY = 1 << 20
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 200
+MAX_PROXIMITY_KM = 100.0  # Well past any ride; larger radii only walk an ever larger grid window
+MAX_BUDGET = 1_000_000
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def number(params, name, default=None):
+    value = params.get(name, [None])[0]
+    if value is None:
+        if default is None:
+            raise HttpError(400, f"Missing parameter: {name}")
+        return default
+    try:
+        value = float(value)
+    except ValueError:
+        raise HttpError(400, f"Parameter {name} must be a number")
+    if not isfinite(value):
+        raise HttpError(400, f"Parameter {name} must be a finite number")
+    return value
+
+
+class RecommendationService:
+    def __init__(self, food_stores, riders, dispatcher, router=None, shards=None, cache=None):
+        self.food_stores = food_stores
+        self.riders = riders
+        self.dispatcher = dispatcher
+        self.router = router
+        self.shards = shards  # ShardPool ranking recommendations in worker processes, if any
+        self.sessions = SessionStore()
+        self.cache = cache  # Optional QueryCache shared by all clients; worth it when clients repeat queries (kiosks)
+
+    def session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HttpError(404, "Unknown session")
+        return session
+
+    async def handle(self, method, path, params, body):
+        parts = [part for part in path.split("/") if part]
+
+        if parts == ["sessions"] and method == "POST":
+            return 201, {"session": self.sessions.create().id}
+
+        if parts == ["recommend"] and method == "GET":
+            stores, next_cursor = await self.recommend(params)
+            return 200, {"stores": stores, "next": next_cursor}
+
+        if parts in (["search"], ["autocomplete"]) and method == "GET":
+            text = params.get("q", [""])[0]
+            limit = int(number(params, "limit", 10))
+            if not 1 <= limit <= MAX_LIMIT:
+                raise HttpError(400, f"Limit must be between 1 and {MAX_LIMIT}")
+            find = search_stores if parts == ["search"] else autocomplete_stores
+            return 200, {"stores": find(self.food_stores.current, text, limit)}
+
+        if len(parts) == 2 and parts[0] == "stores" and method == "GET":
+            return 200, {"store": self.store(parts[1])}
+
+        if len(parts) == 3 and parts[0] == "sessions" and method == "POST":
+            session = self.session(parts[1])
+            if parts[2] == "store":
+                session.selected_store = self.store(body.get("store") if isinstance(body, dict) else None, session)
+                session.selected_rider = None
+                return 200, {"store": session.selected_store}
+            if parts[2] == "rider":
+                return 200, await self.assign_rider(session)
+
+        if parts == ["riders"] and method == "POST":
+            messages = body if isinstance(body, list) else [body]
+            # All or nothing: every message is checked before the first one is applied
+            for message in messages:
+                try:
+                    check_message(message)
+                except ValueError as e:
+                    raise HttpError(400, str(e))
+            applied = sum(1 for message in messages if self.riders.apply(message) is not None)
+            return 200, {"applied": applied}
+
+        if parts == ["stats"] and method == "GET":
+            return 200, {"cache": self.cache.stats() if self.cache is not None else None}
+
+        if parts == ["metrics"] and method == "GET":
+            return 200, metrics.snapshot()
+
+        raise HttpError(404 if method in ("GET", "POST") else 405, f"No route for {method} {path}")
+
+    async def recommend(self, params):
+        budget = number(params, "budget")
+        proximity = number(params, "proximity")
+        cuisine = params.get("cuisine", [""])[0].strip().lower()
+        preferred_time = params.get("time", [None])[0]
+        if budget <= 0 or proximity <= 0:
+            raise HttpError(400, "Budget and proximity must be positive numbers")
+        if budget > MAX_BUDGET or proximity > MAX_PROXIMITY_KM:
+            raise HttpError(400, f"Budget can be at most {MAX_BUDGET} and proximity at most {MAX_PROXIMITY_KM:g} km")
+        if preferred_time is not None and parse_minutes(preferred_time) is None:
+            raise HttpError(400, "Time must be in HH:MM format")
+        try:
+            location = parse_location((number(params, "lat", DEFAULT_LOCATION[0]), number(params, "lon", DEFAULT_LOCATION[1])))
+        except ValueError:
+            raise HttpError(400, "Lat must be within -90..90 and lon within -180..180")
+        limit = int(number(params, "limit", DEFAULT_LIMIT))
+        cursor = params.get("cursor", [None])[0]
+        if not 1 <= limit <= MAX_LIMIT:
+            raise HttpError(400, f"Limit must be between 1 and {MAX_LIMIT}")
+        price_mode = params.get("price", [DEFAULT_PRICE_MODE])[0]
+        if price_mode not in PRICE_MODES:
+            raise HttpError(400, f"Price must be one of {', '.join(PRICE_MODES)}")
+
+        try:
+            if cursor:
+                cursor_key(cursor)
+        except ValueError:
+            raise HttpError(400, "Invalid cursor")
+        if self.shards is not None:
+            # Waits on the workers from a thread, so other clients keep being served meanwhile
+            stores, next_cursor = await asyncio.to_thread(self.shards.rank, budget, preferred_time, proximity, cuisine,
+                                                          location, limit, cursor, price_mode=price_mode)
+        else:
+            stores, next_cursor = rank_stores(self.food_stores.current, budget, preferred_time, proximity, cuisine,
+                                              location, k=limit, cursor=cursor, cache=self.cache, router=self.router,
+                                              price_mode=price_mode)
+        session_id = params.get("session", [None])[0]
+        if session_id:
+            session = self.session(session_id)
+            # A cursor continues the session's list, otherwise this is a new search
+            session.recommendations = session.recommendations + stores if cursor else stores
+            session.cursor = next_cursor
+        return stores, next_cursor
+
+    def store(self, store_id, session=None):
+        try:
+            store_id = int(store_id)
+        except (TypeError, ValueError):
+            raise HttpError(400, "Store id must be an integer")
+        # Prefer the session's own copy, which carries the proximity from its last search
+        for store in session.recommendations if session else ():
+            if store["id"] == store_id:
+                return store
+        catalogue = self.food_stores.current
+        if not 0 <= store_id < len(catalogue) or store_id in catalogue.deleted:
+            raise HttpError(404, "Unknown store")
+        return catalogue.row(store_id)
+
+    async def assign_rider(self, session):
+        store = session.selected_store
+        if store is None:
+            raise HttpError(400, "Select a store first")
+        try:
+            order = self.dispatcher.request((store["lat"], store["lon"]))
+        except ValueError:
+            raise HttpError(400, "The selected store has no map location")
+        assignment = await asyncio.wrap_future(order)
+        if assignment is None:
+            return {"rider": None}
+        distance, session.selected_rider = assignment
+        response = {"rider": session.selected_rider, "distance_km": round(distance, 2)}
+        if self.router is not None:
+            response["eta_minutes"] = round(self.router.eta(session.selected_rider["location"], (store["lat"], store["lon"])) / 60, 1)
+        return response
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                status, payload = await self.respond(method, target, headers, reader)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(
+                    f"{version} {status} {STATUS_TEXT.get(status, '')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # Client went away or sent something that isn't HTTP
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, headers, reader):
+        start = time.perf_counter()
+        status, payload = await self._respond(method, target, headers, reader)
+        # One timer per route ("GET /stores", not per store id) and a counter per status code
+        route = "/" + urlsplit(target).path.strip("/").partition("/")[0]
+        metrics.observe(f"http.{method} {route}", time.perf_counter() - start)
+        metrics.count(f"http.{status}")
+        return status, payload
+
+    async def _respond(self, method, target, headers, reader):
+        try:
+            try:
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                raise HttpError(400, "Content-Length must be a number")
+            if length < 0:
+                raise HttpError(400, "Content-Length can't be negative")
+            if length > MAX_BODY:
+                raise HttpError(413, "Request body too large")
+            raw = await reader.readexactly(length) if length else b""
+            try:
+                body = json.loads(raw) if raw else {}
+            except ValueError:
+                raise HttpError(400, "Body must be JSON")
+            url = urlsplit(target)
+            return await self.handle(method, url.path, parse_qs(url.query), body)
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:
+            print(f"Request failed: {method} {target}: {e!r}")
+            return 500, {"error": "Internal error"}
+
+
+async def serve(host, port, workers=1, rider_ttl=None, cache=False):
+    metrics.start_from_environment()
+    # With several workers, recommendations and riders are split by region across processes; they
+    # map whatever this process's catalogue saves, so /stores/<id> and the shards agree on ids
+    food_stores = LiveCatalogue().start()
+    shards = ShardPool(workers, rider_ttl=rider_ttl, cache=cache, food_stores=food_stores) if workers > 1 else None
+    riders = load_fleet(ShardedRiders(shards) if shards else RiderRegistry(ttl=rider_ttl)).start()
+    router = load_router()
+    service = RecommendationService(food_stores, riders, Dispatcher(riders, router=router).start(), router, shards,
+                                    QueryCache() if cache else None)
+    server = await asyncio.start_server(service.serve_client, host, port)
+    print(f"Ride&Dine service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ride&Dine recommendation service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=1, help="Shard worker processes; 0 for one per CPU")
+    parser.add_argument("--rider-ttl", type=float, default=None,
+                        help="Seconds without an update before a rider stops being offered; by default riders never expire")
+    parser.add_argument("--cache", action="store_true",
+                        help="Share a query cache between clients; pays off when they repeat queries, e.g. kiosks")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.workers if args.workers > 0 else os.cpu_count() or 1, args.rider_ttl, args.cache))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import time
+import uuid
+
+
+# What one user has picked so far; this used to live in module globals, which meant every
+# user of a process shared one selection
+class Session:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.query = None  # Arguments of the last recommendation search
+        self.recommendations = []  # Pages of it served so far
+        self.cursor = None  # Where the next page starts, None when there is no more
+        self.selected_store = None
+        self.selected_rider = None
+        self.last_seen = time.monotonic()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+        return self
+
+
+class SessionStore:
+    def __init__(self, idle_timeout=30 * 60):
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self):
+        self.expire()
+        session = Session()
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        return session.touch() if session else None
+
+    def expire(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for session_id in [sid for sid, session in self.sessions.items() if session.last_seen < cutoff]:
+            del self.sessions[session_id]
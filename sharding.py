@@ -0,0 +1,237 @@
+import heapq
+import multiprocessing
+import os
+import threading
+from itertools import chain
+from math import cos, radians
+import metrics
+from food_store import Catalogue, map_food_stores, page_of, rank_page
+from query_cache import QueryCache
+from rider import RiderRegistry
+from routing import load_router
+from spatial import cell_of, KM_PER_DEGREE
+from utils import parse_location, DEFAULT_PRICE_MODE
+from watcher import LiveCatalogue
+
+# Sharded deployment: the city is cut into square regions of REGION_KM and every region belongs to
+# one worker process. Each worker maps the same catalogue snapshot (the OS shares those pages
+# between processes) but only indexes the grid cells of its own regions, and holds the riders
+# currently inside them. The parent routes each query to the workers whose regions the search
+# radius overlaps and merges their top-k pages, so unrelated queries run on different cores.
+# Only the parent watches the CSV: its LiveCatalogue saves every reload to the snapshot and the
+# workers re-map that file, so all processes serve the same version with the same store ids.
+REGION_KM = 5.0
+
+
+class Regions:
+    def __init__(self, workers, region_km=REGION_KM):
+        self.workers = workers
+        # Regions are whole blocks of catalogue cells, so a cell never straddles two shards
+        self.factor = max(1, round(region_km / Catalogue.CELL_KM))
+
+    def shard_of_cell(self, cell):
+        # Neighbouring regions land on different workers, spreading a busy town over several
+        return (cell[0] // self.factor * 7919 + cell[1] // self.factor) % self.workers
+
+    def shard_of(self, lat, lon):
+        return self.shard_of_cell(cell_of(lat, lon, Catalogue.CELL_KM))
+
+    def shards_within(self, lat, lon, radius_km):
+        # Every shard owning a region that the circle's bounding box touches
+        dlat = radius_km / KM_PER_DEGREE
+        dlon = radius_km / (KM_PER_DEGREE * max(cos(radians(lat)), 0.01))
+        first_row, first_col = cell_of(lat - dlat, lon - dlon, Catalogue.CELL_KM)
+        last_row, last_col = cell_of(lat + dlat, lon + dlon, Catalogue.CELL_KM)
+        shards = set()
+        for row in range(first_row // self.factor, last_row // self.factor + 1):
+            for col in range(first_col // self.factor, last_col // self.factor + 1):
+                shards.add((row * 7919 + col) % self.workers)
+                if len(shards) == self.workers:
+                    return shards
+        return shards
+
+
+def _worker(conn, shard, workers, region_km, snapshot_path, roads_path, rider_ttl, cache):
+    regions = Regions(workers, region_km)
+    view = None  # This shard's part of the catalogue version last mapped (see ShardPool.sync)
+    riders = RiderRegistry(path=None, feed_path=None, ttl=rider_ttl)
+    cache = QueryCache() if cache else None
+    router = load_router(roads_path)
+
+    while True:
+        try:
+            op, args = conn.recv()
+        except EOFError:
+            break
+        if op == "stop":
+            break
+        try:
+            if op == "map":
+                catalogue = map_food_stores(snapshot_path, *args)
+                if catalogue is None:
+                    raise ValueError(f"{snapshot_path} no longer holds catalogue {args[0]}")
+                view = catalogue.restricted(lambda cell: regions.shard_of_cell(cell) == shard)
+                result = None
+            elif op == "rank":
+                *query, price_mode = args
+                result = rank_page(view, *query, cache=cache, router=router, price_mode=price_mode)
+            elif op == "update":
+                rider_id, location, availability, fields = args
+                result = riders.update(rider_id, location, availability, **fields)
+            elif op == "remove":
+                result = riders.remove(*args)
+            elif op == "nearest":
+                result = riders.nearest_available(*args)
+            elif op == "available":
+                result = riders.available_riders()
+            elif op == "export":
+                result = riders.export()
+            else:
+                raise ValueError(f"Unknown operation {op!r}")
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, repr(e)))
+
+
+class ShardPool:
+    def __init__(self, workers=None, csv_path='eateries.csv', snapshot_path='eateries.snapshot', roads_path='roads.json',
+                 region_km=REGION_KM, rider_ttl=None, cache=False, food_stores=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.regions = Regions(self.workers, region_km)
+        # The one LiveCatalogue of the deployment; loading it compiles the snapshot the workers map
+        self.food_stores = food_stores if food_stores is not None else LiveCatalogue(csv_path, snapshot_path)
+        self.version = None  # Catalogue version every worker has mapped
+        self.connections, self.processes = [], []
+        # Spawned, not forked: the parent already runs threads (the catalogue watcher, metrics
+        # exporter, profiler), and a fork taken while one of them holds a lock, e.g. the metrics
+        # lock, leaves that lock held forever in the child
+        context = multiprocessing.get_context("spawn")
+        for shard in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_worker, name=f"shard-{shard}", daemon=True,
+                args=(child, shard, self.workers, region_km, snapshot_path, roads_path, rider_ttl, cache))
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self.locks = [threading.Lock() for _ in range(self.workers)]  # One request in flight per pipe
+        self.sync_lock = threading.Lock()
+        self.sync()
+
+    def sync(self):
+        # Has every worker map the parent's current catalogue, once per version. Raises RuntimeError
+        # when a worker can't, e.g. a newer reload already replaced the snapshot; the next call retries.
+        version = self.food_stores.current.version
+        if version == self.version:
+            return
+        with self.sync_lock:
+            if version != self.version:
+                self.call_many([(shard, "map", (version,)) for shard in range(self.workers)])
+                self.version = version
+
+    def call(self, shard, op, *args):
+        return self.call_many([(shard, op, args)])[0]
+
+    def call_many(self, requests):
+        # Sends every request before waiting on any, so the shards work on them in parallel.
+        # Locks are taken in shard order, so two callers can't deadlock on each other.
+        shards = sorted({shard for shard, _, _ in requests})
+        for shard in shards:
+            self.locks[shard].acquire()
+        try:
+            for shard, op, args in requests:
+                self.connections[shard].send((op, args))
+            results = []
+            for shard, op, _ in requests:
+                ok, value = self.connections[shard].recv()
+                if not ok:
+                    raise RuntimeError(f"Shard {shard} failed {op}: {value}")
+                results.append(value)
+            return results
+        finally:
+            for shard in shards:
+                self.locks[shard].release()
+
+    @metrics.timed("shards.rank")
+    def rank(self, budget, time, proximity, cuisine, location, k=10, cursor=None, weights=None, price_mode=DEFAULT_PRICE_MODE):
+        # Same result as food_store.rank_stores: (stores, next cursor)
+        try:
+            self.sync()
+        except RuntimeError as e:
+            print(f"Shards still serve catalogue {self.version}: {e}")
+        k = max(k, 1)
+        shards = self.regions.shards_within(location[0], location[1], proximity)
+        args = (budget, time, proximity, cuisine, location, k, cursor, weights, price_mode)
+        pages = self.call_many([(shard, "rank", args) for shard in shards])
+        return page_of(heapq.nsmallest(k + 1, chain(*pages), key=lambda item: (-item[0], item[1])), k)
+
+    def stop(self):
+        for shard, connection in enumerate(self.connections):
+            with self.locks[shard]:
+                connection.send(("stop", ()))
+        for process in self.processes:
+            process.join(timeout=5)
+
+
+# RiderRegistry whose riders live in the shard workers, each rider in the worker owning its
+# current region. The feed, snapshots and the Dispatcher work unchanged on top of it.
+class ShardedRiders(RiderRegistry):
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+        self.owner = {}  # Rider id -> shard holding it
+
+    def __len__(self):
+        return len(self.owner)
+
+    def update(self, rider_id, location=None, availability=None, heartbeat=True, **fields):
+        # Heartbeats and their expiry are kept by the worker holding the rider (see ShardPool rider_ttl)
+        if location is not None:
+            location = parse_location(location)  # Checked before any worker is touched
+        with self.lock:
+            shard = self.owner.get(rider_id)
+            if location is not None:
+                target = self.pool.regions.shard_of(*location)
+            else:
+                target = shard if shard is not None else 0
+            if shard is not None and shard != target:
+                # Crossed into another worker's region: hand the whole rider over
+                moved = self.pool.call(shard, "remove", rider_id) or {}
+                if availability is None:
+                    availability = moved.get("availability")
+                fields = dict({key: value for key, value in moved.items() if key not in ("id", "location", "availability")}, **fields)
+            rider = self.pool.call(target, "update", rider_id, location, availability, dict(fields, heartbeat=heartbeat))
+            self.owner[rider_id] = target
+            self.dirty = True
+            return rider
+
+    def remove(self, rider_id):
+        with self.lock:
+            shard = self.owner.pop(rider_id, None)
+            if shard is None:
+                return None
+            self.dirty = True
+            return self.pool.call(shard, "remove", rider_id)
+
+    def available_riders(self):
+        return list(chain(*self.pool.call_many([(shard, "available", ()) for shard in range(self.pool.workers)])))
+
+    def export(self):
+        return list(chain(*self.pool.call_many([(shard, "export", ()) for shard in range(self.pool.workers)])))
+
+    def nearest_available(self, location, k=3, max_km=None):
+        # Asks the shards around location first and widens the circle only while a shard not yet
+        # asked could still hold someone closer than the current k-th rider
+        asked, found = set(), []
+        radius = REGION_KM
+        while len(asked) < self.pool.workers:
+            shards = self.pool.regions.shards_within(location[0], location[1], radius) - asked
+            if shards:
+                for riders in self.pool.call_many([(shard, "nearest", (location, k, max_km)) for shard in shards]):
+                    found.extend(riders)
+                asked |= shards
+                found = heapq.nsmallest(k, found, key=lambda item: item[0])
+            if (len(found) == k and found[-1][0] <= radius) or (max_km is not None and radius >= max_km):
+                break
+            radius *= 2
+        return found
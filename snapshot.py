@@ -0,0 +1,118 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+
+# Compiled catalogue snapshot: a fixed header, a table of sections and the raw column bytes.
+# Every section is 8-byte aligned so it can be used straight out of the mmap as a typed
+# memoryview, without parsing or copying anything at startup.
+#
+#   header   MAGIC, VERSION, sha256 of the source file, section count
+#   toc      one entry per section: name, typecode, offset, byte length
+#   data     numeric columns as arrays; string columns as a utf-8 blob plus an offsets array
+MAGIC = b"RIDEDINE"
+VERSION = 2  # 2: grid buckets sorted by min_price
+HEADER = struct.Struct("<8sI32sI")
+SECTION = struct.Struct("<24s2sQQ")
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').digest()
+
+
+# Read-only string column backed by a utf-8 blob; strings are only decoded when asked for
+class StringColumn:
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+
+def encode_strings(strings):
+    offsets = array('I', [0])
+    data = bytearray()
+    for string in strings:
+        data += string.encode('utf-8')
+        offsets.append(len(data))
+    return offsets, data
+
+
+def write_snapshot(path, digest, numeric_columns, string_columns):
+    # numeric_columns: {name: array}, string_columns: {name: list of str}
+    sections = [(name, column.typecode, column) for name, column in numeric_columns.items()]
+    for name, strings in string_columns.items():
+        offsets, data = encode_strings(strings)
+        sections.append((name + ".offsets", offsets.typecode, offsets))
+        sections.append((name + ".data", "B", data))
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    toc, payload = [], []
+    for name, typecode, column in sections:
+        offset += -offset % 8
+        raw = bytes(column)
+        toc.append(SECTION.pack(name.encode('ascii'), typecode.encode('ascii'), offset, len(raw)))
+        payload.append((offset, raw))
+        offset += len(raw)
+
+    # Written to a temp file of its own beside the target and renamed, so a reader never sees a
+    # half-written snapshot and processes compiling at the same time don't write into one file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, digest, len(sections)))
+            f.write(b"".join(toc))
+            for offset, raw in payload:
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(raw)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_snapshot(path, digest):
+    # Returns ({name: memoryview or StringColumn}, mmap), or None when the snapshot is missing,
+    # from another format version, built from a different source file or cut short
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapped) < HEADER.size:
+        return None
+    magic, version, snapshot_digest, count = HEADER.unpack_from(mapped)
+    if magic != MAGIC or version != VERSION or snapshot_digest != digest:
+        return None
+    if HEADER.size + count * SECTION.size > len(mapped):
+        return None
+
+    view = memoryview(mapped)
+    sections = {}
+    for i in range(count):
+        name, typecode, offset, length = SECTION.unpack_from(mapped, HEADER.size + i * SECTION.size)
+        if offset + length > len(mapped):
+            return None
+        try:
+            typecode = typecode.rstrip(b"\0").decode('ascii')
+            sections[name.rstrip(b"\0").decode('ascii')] = view[offset:offset + length].cast(typecode)
+        except (TypeError, ValueError):
+            return None
+
+    columns = {}
+    for name, section in sections.items():
+        if name.endswith(".offsets"):
+            columns[name[:-len(".offsets")]] = StringColumn(section, sections[name[:-len(".offsets")] + ".data"])
+        elif not name.endswith(".data"):
+            columns[name] = section
+    return columns, mapped
@@ -0,0 +1,185 @@
+import heapq
+from collections import defaultdict
+from math import cos, floor, radians
+from utils import distances_from_vectors, to_unit_vector
+
+KM_PER_DEGREE = 111.32  # Length of one degree of latitude in km
+
+
+def cell_of(lat, lon, cell_km):
+    cell_deg = cell_km / KM_PER_DEGREE
+    return floor(lat / cell_deg), floor(lon / cell_deg)
+
+
+def cells_within(cells, lat, lon, radius_km, cell_km):
+    # Yields the contents of every cell in `cells` ({(row, col): bucket}) that a circle of
+    # radius_km around (lat, lon) can overlap
+    row_span = int(radius_km / cell_km) + 1
+    # Cells get narrower in km towards the poles, so widen the column span accordingly
+    col_span = int(radius_km / (cell_km * max(cos(radians(lat)), 0.01))) + 1
+    row, col = cell_of(lat, lon, cell_km)
+
+    # A sparse grid is cheaper to scan than a wide window of mostly empty cells
+    if (2 * row_span + 1) * (2 * col_span + 1) > len(cells):
+        for (r, c), bucket in cells.items():
+            if abs(r - row) <= row_span and abs(c - col) <= col_span:
+                yield bucket
+        return
+
+    for r in range(row - row_span, row + row_span + 1):
+        for c in range(col - col_span, col + col_span + 1):
+            bucket = cells.get((r, c))
+            if bucket:
+                yield bucket
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash(lat, lon, precision=6):
+    # Standard base-32 geohash: bits alternate longitude/latitude, halving the range each time.
+    # Precision 6 is a cell of roughly 1.2 x 0.6 km.
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        span, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+def geohash_bounds(code):
+    # (min_lat, max_lat, min_lon, max_lon) of a geohash cell
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in code:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            span = lon_range if even else lat_range
+            middle = (span[0] + span[1]) / 2
+            if value >> shift & 1:
+                span[0] = middle
+            else:
+                span[1] = middle
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+# Uniform lat/lon grid: every key lives in exactly one cell, so inserts, moves and removals are O(1)
+# and a radius query only looks at the cells the search circle overlaps.
+class GridIndex:
+    def __init__(self, cell_km=0.5):
+        self.cell_km = cell_km
+        self.cells = defaultdict(dict)  # (row, col) -> {key: (lat, lon, unit_vector)}
+        self.cell_by_key = {}
+
+    def __len__(self):
+        return len(self.cell_by_key)
+
+    def __contains__(self, key):
+        return key in self.cell_by_key
+
+    def __iter__(self):
+        return iter(self.cell_by_key)
+
+    def cell_of(self, lat, lon):
+        return cell_of(lat, lon, self.cell_km)
+
+    def insert(self, key, lat, lon):
+        cell = self.cell_of(lat, lon)
+        old_cell = self.cell_by_key.get(key)
+        if old_cell is not None and old_cell != cell:
+            self._discard(key, old_cell)
+        # The unit vector is kept so radius queries can use the batched distance maths directly
+        self.cells[cell][key] = (lat, lon, to_unit_vector(lat, lon))
+        self.cell_by_key[key] = cell
+
+    # Moving a key is the same operation as inserting it again
+    move = insert
+
+    def remove(self, key):
+        cell = self.cell_by_key.pop(key, None)
+        if cell is not None:
+            self._discard(key, cell)
+
+    def _discard(self, key, cell):
+        bucket = self.cells[cell]
+        bucket.pop(key, None)
+        if not bucket:
+            del self.cells[cell]
+
+    def position(self, key):
+        return self.cells[self.cell_by_key[key]][key][:2]
+
+    def cells_within(self, lat, lon, radius_km):
+        return cells_within(self.cells, lat, lon, radius_km, self.cell_km)
+
+    def within(self, lat, lon, radius_km):
+        # Returns (distance_km, key) for every key inside the radius, unsorted
+        keys, vectors = [], []
+        for bucket in self.cells_within(lat, lon, radius_km):
+            keys.extend(bucket)
+            vectors.extend(position[2] for position in bucket.values())
+        distances = distances_from_vectors((lat, lon), vectors)
+        return [(distance, key) for distance, key in zip(distances, keys) if distance <= radius_km]
+
+    def ring(self, row, col, radius):
+        # Cells at Chebyshev distance `radius` from (row, col), i.e. the outline of a square
+        if radius == 0:
+            yield row, col
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, col - radius
+            yield r, col + radius
+
+    def nearest(self, lat, lon, k=1, max_km=None):
+        # The k closest keys as (distance_km, key), nearest first. Searches outward ring by ring
+        # and stops as soon as no unvisited cell can hold anything closer than the current k-th.
+        row, col = self.cell_of(lat, lon)
+        best = []  # Max-heap of the k closest so far, stored as (-distance, key)
+        visited = 0
+
+        def consider(buckets):
+            keys, vectors = [], []
+            for bucket in buckets:
+                keys.extend(bucket)
+                vectors.extend(position[2] for position in bucket.values())
+            for distance, key in zip(distances_from_vectors((lat, lon), vectors), keys):
+                if max_km is not None and distance > max_km:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, key))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, key))
+            return len(keys)
+
+        radius = 0
+        while visited < len(self):
+            # Anything in ring `radius` is at least radius - 1 whole cells away; cells are
+            # narrowest east-west, and narrower still the further the ring reaches from the equator
+            reach = min(abs(lat) + radius * self.cell_km / KM_PER_DEGREE, 89.0)
+            bound = max(radius - 1, 0) * self.cell_km * cos(radians(reach))
+            if max_km is not None and bound > max_km:
+                break
+            if len(best) == k and bound > -best[0][0]:
+                break
+            if 8 * radius > len(self.cells):
+                # The ring has outgrown the occupied grid, so finish with one pass over what's left
+                visited += consider(bucket for (r, c), bucket in self.cells.items()
+                                    if max(abs(r - row), abs(c - col)) >= radius)
+                break
+            visited += consider(filter(None, map(self.cells.get, self.ring(row, col, radius))))
+            radius += 1
+
+        return sorted((-distance, key) for distance, key in best)
@@ -1,4 +1,10 @@
-from math import radians, cos, sin, sqrt, atan2
+from array import array
+from itertools import repeat
+from math import radians, cos, sin, sqrt, atan2, asin, dist, isfinite
+from operator import mul
+import re
+
+EARTH_RADIUS_KM = 6371
 
 def safe_float(value):
     try:
@@ -18,3 +24,83 @@ def calculate_distance(coord1, coord2):
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
     distance = R * c
     return distance
+
+# Batched great-circle distances. Points are turned into unit vectors once, after which the
+# haversine distance is 2R * asin(chord / 2); every step below is a C-level map, so ranking
+# many riders or stores costs no Python bytecode per pair.
+def to_unit_vector(lat, lon):
+    lat, lon = radians(lat), radians(lon)
+    return cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat)
+
+def to_unit_vectors(lats, lons):
+    return list(map(to_unit_vector, lats, lons))
+
+def distances_from_vectors(origin, vectors):
+    half_chords = map(mul, repeat(0.5), map(dist, repeat(to_unit_vector(*origin)), vectors))
+    # min() guards asin against rounding just past 1.0 for antipodal points
+    return array('d', map(mul, repeat(2 * EARTH_RADIUS_KM), map(asin, map(min, repeat(1.0), half_chords))))
+
+def distances_from(origin, lats, lons):
+    # One-to-many: distance in km from origin to every (lats[i], lons[i])
+    return distances_from_vectors(origin, to_unit_vectors(lats, lons))
+
+def distance_matrix(origins, lats, lons):
+    # Many-to-many: one row of distances per origin, converting the targets only once
+    vectors = to_unit_vectors(lats, lons)
+    return [distances_from_vectors(origin, vectors) for origin in origins]
+
+# Fixed point the app used to measure everything from, kept as the default user location
+DEFAULT_LOCATION = (13.7859177, 121.0706258)
+
+# Google Maps place URLs carry the pin as "!3d<lat>!4d<lon>"; the last pair is the place itself
+COORDINATES_PATTERN = re.compile(r"!3d(-?\d+(?:\.\d+)?)!4d(-?\d+(?:\.\d+)?)")
+
+def parse_coordinates(location_url):
+    matches = COORDINATES_PATTERN.findall(location_url or "")
+    if not matches:
+        return None
+    lat, lon = matches[-1]
+    return float(lat), float(lon)
+
+def parse_location(location):
+    # [lat, lon] from a request or feed -> (lat, lon) floats; ValueError unless both are finite
+    # numbers on the globe
+    try:
+        if isinstance(location, (str, bytes)) or len(location) != 2:
+            raise ValueError
+        lat, lon = float(location[0]), float(location[1])
+    except (TypeError, ValueError, IndexError, KeyError):
+        raise ValueError(f"Not a [lat, lon] location: {location!r}")
+    if not (isfinite(lat) and isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"Not a [lat, lon] location: {location!r}")
+    return lat, lon
+
+MINUTES_PER_DAY = 24 * 60
+
+def parse_minutes(clock):
+    # "HH:MM" -> minute of the day, None if it isn't a valid time
+    try:
+        hours, minutes = map(int, clock.strip().split(":"))
+    except (AttributeError, ValueError):
+        return None
+    if 0 <= hours < 24 and 0 <= minutes < 60:
+        return hours * 60 + minutes
+    return None
+
+def parse_opening_hours(time_range):
+    # "06:00-21:00" -> (360, 900): opening minute and how many minutes the store stays open.
+    # A closing time at or before the opening time runs past midnight, e.g. "01:00-00:00" is
+    # open from 01:00 until the end of the day; identical times mean open all day.
+    opening, _, closing = (time_range or "").partition("-")
+    open_from, open_to = parse_minutes(opening), parse_minutes(closing)
+    if open_from is None or open_to is None:
+        return None
+    return open_from, (open_to - open_from) % MINUTES_PER_DAY or MINUTES_PER_DAY
+
+# What "within budget" means, shared by every front end:
+#   "entry"  the cheapest item is affordable (min_price <= budget)
+#   "range"  the budget falls inside the store's price range (min_price <= budget <= max_price)
+PRICE_ENTRY = "entry"
+PRICE_RANGE = "range"
+PRICE_MODES = (PRICE_ENTRY, PRICE_RANGE)
+DEFAULT_PRICE_MODE = PRICE_ENTRY
@@ -0,0 +1,102 @@
+import csv
+import metrics
+import os
+import threading
+from food_store import load_food_stores, map_food_stores, store_fields
+from snapshot import file_digest, write_snapshot
+
+
+def diff_records(catalogue, records):
+    # Matches stores by (name, location_url) and returns (added records, {row: changed record}, removed rows)
+    current = {}
+    for row in range(len(catalogue)):
+        if row not in catalogue.deleted:
+            current.setdefault((catalogue.names[row], catalogue.location_urls[row]), []).append(row)
+
+    added, changed = [], {}
+    for record in records:
+        fields = store_fields(record)
+        rows = current.get((fields["name"], fields["location_url"]))
+        if not rows:
+            added.append(record)
+            continue
+        row = rows.pop(0)
+        if not fields.items() <= catalogue.row(row).items():
+            changed[row] = record
+
+    removed = [row for rows in current.values() for row in rows]
+    return added, changed, removed
+
+
+# Holds the catalogue every session reads from and swaps in a new version whenever eateries.csv
+# changes. Readers just take `.current` at the start of a request; replacing that reference is
+# atomic, so a reload never blocks or half-updates a running query.
+class LiveCatalogue:
+    def __init__(self, csv_path='eateries.csv', snapshot_path='eateries.snapshot', interval=2.0):
+        self.csv_path = csv_path
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self.file_stat = self._stat()
+        self.current = load_food_stores(csv_path, snapshot_path)
+        self._reload_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        stat = os.stat(self.csv_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="catalogue-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except (OSError, ValueError, csv.Error) as e:
+                # A file caught mid-write or with a bad row; keep serving the current version
+                print(f"Catalogue reload skipped: {e}")
+
+    def check(self):
+        file_stat = self._stat()
+        if file_stat == self.file_stat:
+            return False
+        reloaded = self.reload()
+        self.file_stat = file_stat
+        return reloaded
+
+    @metrics.timed("catalogue.reload")
+    def reload(self):
+        with self._reload_lock:
+            digest = file_digest(self.csv_path)
+            if digest.hex() == self.current.version:
+                return False
+            with open(self.csv_path, 'r', encoding='utf-8', newline='') as f:
+                records = list(csv.DictReader(f))
+
+            # Always patched, never rebuilt: row ids are the public store ids (/stores/<id>, session
+            # selections, paging cursors), so a store keeps its id however much of the file changed
+            added, changed, removed = diff_records(self.current, records)
+            catalogue = self.current.updated(added, changed, removed)
+            catalogue.version = digest.hex()
+            # Saved under the new digest and mapped back: a restart then keeps these ids, and shard
+            # workers map the same pages instead of each reloading the CSV (see ShardPool.sync)
+            try:
+                write_snapshot(self.snapshot_path, digest, *catalogue.columns())
+                mapped = map_food_stores(self.snapshot_path, catalogue.version)
+                if mapped is not None:
+                    mapped._name_index = catalogue._name_index
+                    catalogue = mapped
+            except OSError as e:
+                print(f"Catalogue snapshot not saved: {e}")
+            # Patched from the previous version's index by updated(); only built here, before the
+            # swap so searches never wait for it, when the previous version had none
+            catalogue.name_index()
+            self.current = catalogue
+            return True
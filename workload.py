@@ -0,0 +1,157 @@
+import csv
+import json
+import random
+
+# Request log format for replaying traffic: one JSON object per line, e.g.
+#   {"budget": 250, "time": "12:15", "lat": 13.7859, "lon": 121.0706, "proximity": 2.0,
+#    "cuisine": "fastfood", "need_rider": true}
+# "time" may be null (no opening-hours filter); everything else is required.
+REQUEST_FIELDS = {
+    "budget": (int, float),
+    "time": (str, type(None)),
+    "lat": (int, float),
+    "lon": (int, float),
+    "proximity": (int, float),
+    "cuisine": (str,),
+    "need_rider": (bool,),
+}
+
+CUISINES = ["Fastfood", "Steak/Barbecue restaurant", "Family Restaurant", "Asian restaurant", "Chicken restaurant",
+            "Bakery/Pastries", "Hamburger restaurant", "Seafood Restaurant", "Pizza Restaurant", "Korean Restaurant"]
+CUISINE_WEIGHTS = [30, 6, 20, 8, 10, 5, 6, 4, 6, 5]
+
+# Synthetic city: Batangas City and the towns around it, roughly 30 x 30 km
+CITY_CENTER = (13.7565, 121.0583)
+CITY_SPAN = 0.27  # Degrees either side of the centre
+
+
+def parse_request(line):
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("Request must be a JSON object")
+    for field, types in REQUEST_FIELDS.items():
+        if not isinstance(request.get(field), types):
+            raise ValueError(f"Request field {field!r} is missing or has the wrong type")
+    return request
+
+
+def read_requests(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [parse_request(line) for line in f if line.strip()]
+
+
+def write_requests(path, requests):
+    with open(path, 'w', encoding='utf-8') as f:
+        for request in requests:
+            f.write(json.dumps(request) + "\n")
+
+
+def city_point(rng, hotspots):
+    # Most activity clusters around a few town centres, the rest is spread over the whole city
+    if rng.random() < 0.8:
+        lat, lon = rng.choice(hotspots)
+        return lat + rng.gauss(0, 0.015), lon + rng.gauss(0, 0.015)
+    return CITY_CENTER[0] + rng.uniform(-CITY_SPAN, CITY_SPAN), CITY_CENTER[1] + rng.uniform(-CITY_SPAN, CITY_SPAN)
+
+
+def hotspots(rng, count=12):
+    return [(CITY_CENTER[0] + rng.uniform(-CITY_SPAN, CITY_SPAN) * 0.7,
+             CITY_CENTER[1] + rng.uniform(-CITY_SPAN, CITY_SPAN) * 0.7) for _ in range(count)]
+
+
+def opening_hours(rng):
+    roll = rng.random()
+    if roll < 0.1:
+        return ""  # Hours not listed
+    if roll < 0.2:
+        return "01:00-00:00"
+    opening = rng.choice([6, 7, 8, 9, 10, 11, 15])
+    closing = (opening + rng.choice([8, 10, 12, 14, 16])) % 24
+    return f"{opening:02d}:{rng.choice(['00', '30'])}-{closing:02d}:00"
+
+
+def generate_catalogue(path, count, seed=1):
+    # Writes an eateries.csv-shaped file with `count` stores
+    rng = random.Random(seed)
+    spots = hotspots(rng)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["cuisine_type", "proximity", "name", "location_url", "ratings", "time", "fb_page_url", "max_price", "min_price"])
+        for i in range(count):
+            lat, lon = city_point(rng, spots)
+            cuisine = rng.choices(CUISINES, CUISINE_WEIGHTS)[0]
+            name = f"Store {i} {cuisine.split()[0]}"
+            url = f"https://www.google.com/maps/place/{name.replace(' ', '+')}/data=!3m1!4b1!8m2!3d{lat:.7f}!4d{lon:.7f}"
+            min_price = rng.choice([1, 35, 50, 70, 100, 150, 200])
+            max_price = min_price + rng.choice([50, 150, 200, 300])
+            rating = "" if rng.random() < 0.2 else f"{rng.uniform(3.0, 5.0):.1f}"
+            fb_page = f"https://www.facebook.com/store{i}" if rng.random() < 0.3 else ""
+            writer.writerow([cuisine, 0, name, url, rating, opening_hours(rng), fb_page, max_price, min_price])
+
+
+def generate_riders(path, count, seed=2):
+    # Writes a riders.json-shaped file with `count` riders
+    rng = random.Random(seed)
+    spots = hotspots(random.Random(1))  # Same towns as the catalogue
+    riders = []
+    for i in range(count):
+        phone_number = f"+639{rng.randint(10000000, 99999999)}{i % 10}"
+        riders.append({
+            "id": f"rider-{i}",
+            "name": f"Rider {i}",
+            "location": city_point(rng, spots),
+            "availability": rng.random() < 0.7,
+            "phone_number": phone_number,
+        })
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(riders, f)
+
+
+def generate_road_graph(path, spacing_km=0.5, seed=4):
+    # Writes a roads.json-shaped street grid over the synthetic city: residential streets every
+    # spacing_km, faster two-way arterials every fifth line and a few one-way streets
+    rng = random.Random(seed)
+    step = spacing_km / 111.32
+    size = int(2 * CITY_SPAN / step) + 1
+    origin = (CITY_CENTER[0] - CITY_SPAN, CITY_CENTER[1] - CITY_SPAN)
+    nodes = [[round(origin[0] + row * step, 6), round(origin[1] + col * step, 6)] for row in range(size) for col in range(size)]
+    edges = []
+    for row in range(size):
+        for col in range(size):
+            node = row * size + col
+            for neighbour, line in ((node + 1, row), (node + size, col)):
+                if (neighbour == node + 1 and col == size - 1) or neighbour >= size * size:
+                    continue
+                if rng.random() < 0.05:
+                    continue  # Missing block: rivers, walls, dead ends
+                speed = 35 if line % 5 == 0 else 15 + rng.choice([0, 5])
+                edges.append([node, neighbour, speed, line % 5 != 0 and rng.random() < 0.1])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"nodes": nodes, "edges": edges}, f)
+
+
+def kiosk_requests(requests, sites=6, seed=5):
+    # The same requests sent from a few fixed kiosks (one per town centre) instead of from phones
+    # all over the city, the traffic a shared query cache is meant for
+    kiosks = hotspots(random.Random(seed), sites)
+    rng = random.Random(seed)
+    return [dict(request, lat=round(lat, 6), lon=round(lon, 6))
+            for request, (lat, lon) in zip(requests, (rng.choice(kiosks) for _ in requests))]
+
+
+def generate_requests(count, seed=3):
+    rng = random.Random(seed)
+    spots = hotspots(random.Random(1))
+    requests = []
+    for _ in range(count):
+        lat, lon = city_point(rng, spots)
+        requests.append({
+            "budget": rng.choice([100, 150, 200, 250, 300, 500]),
+            "time": None if rng.random() < 0.1 else f"{rng.choice([7, 11, 12, 13, 18, 19, 20, 23]):02d}:{rng.choice([0, 15, 30, 45]):02d}",
+            "lat": round(lat, 6),
+            "lon": round(lon, 6),
+            "proximity": rng.choice([0.5, 1, 1, 2, 2, 3, 5]),
+            "cuisine": rng.choices(CUISINES, CUISINE_WEIGHTS)[0].lower(),
+            "need_rider": rng.random() < 0.4,
+        })
+    return requests